@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine
+import numpy as np
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
 from datetime import datetime, timedelta, date
 import plotly.express as px
 import calendar
@@ -19,35 +21,546 @@ from reportlab.graphics.charts.legends import Legend
 from reportlab.lib.colors import HexColor
 from reportlab.graphics.shapes import String
 from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.graphics.charts.barcharts import VerticalBarChart
 from reportlab.graphics.charts.textlabels import Label
 import os
-
-# 连接到iTop数据库
-def connect_to_itop_db():
-    # 从配置文件读取数据库连接信息    
+import sys
+import json
+import argparse
+import cProfile
+import pstats
+import time
+import threading
+import functools
+import hashlib
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, TimeoutError as FutureTimeoutError
+import multiprocessing
+import importlib
+from collections import OrderedDict
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape as xml_escape
+from streamlit.runtime.scriptrunner import get_script_run_ctx, RerunException, StopException
+import pyarrow as pa
+
+# 读取配置文件
+def load_config():
     config = configparser.ConfigParser()
     config.read('config.ini')
+    return config
+
+# 监控指标(Prometheus文本格式)：计数器、仪表和直方图，按标签分别统计
+class Metric:
+    def __init__(self, kind, name, help, labels=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def observe(self, value, **labels):
+        with self._lock:
+            key = self._key(labels)
+            # 每个桶一个计数，最后两项为总和和总数
+            state = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        def format_labels(key, extra=()):
+            pairs = list(zip(self.labels, key)) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+            return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + '}'
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                if self.kind != 'histogram':
+                    lines.append(f"{self.name}{format_labels(key)} {value}")
+                    continue
+                for bound, count in zip(self.buckets, value):
+                    lines.append(f"{self.name}_bucket{format_labels(key, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(key, [('le', '+Inf')])} {value[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {value[-2]}")
+                lines.append(f"{self.name}_count{format_labels(key)} {value[-1]}")
+        return '\n'.join(lines)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# 报表应用的全部监控指标
+class ReportMetrics:
+    def __init__(self):
+        self.query_seconds = Metric('histogram', 'itop_report_query_duration_seconds', '数据库查询耗时(不含缓存命中)', ('query',), LATENCY_BUCKETS)
+        self.query_rows = Metric('histogram', 'itop_report_query_rows', '查询返回的行数', ('query',), ROW_BUCKETS)
+        self.cache_requests = Metric('counter', 'itop_report_cache_requests_total', '查询结果缓存的请求次数', ('result',))
+        self.cache_hit_ratio = Metric('gauge', 'itop_report_cache_hit_ratio', '查询结果缓存命中率')
+        self.pdf_seconds = Metric('histogram', 'itop_report_pdf_build_duration_seconds', 'PDF报表生成耗时', (), LATENCY_BUCKETS)
+        self.pool_checkouts = Metric('counter', 'itop_report_pool_checkouts_total', '从连接池借出连接的次数', ('pool',))
+        self.pool_wait_seconds = Metric('histogram', 'itop_report_pool_wait_seconds', '查询等待获取连接的时间', (), LATENCY_BUCKETS)
+        self.pool_checked_out = Metric('gauge', 'itop_report_pool_checked_out', '当前借出的连接数', ('pool',))
+        self.errors = Metric('counter', 'itop_report_errors_total', '错误次数', ('kind', 'error'))
+        self.pools = {}
+
+    def watch_pool(self, name, engine):
+        self.pools[name] = engine
+        event.listen(engine, 'checkout', lambda *args: self.pool_checkouts.inc(pool=name))
+
+    def render(self):
+        for name, engine in self.pools.items():
+            self.pool_checked_out.set(engine.pool.checkedout(), pool=name)
+        hits = self.cache_requests.values.get(('hit',), 0)
+        total = hits + self.cache_requests.values.get(('miss',), 0)
+        if total:
+            self.cache_hit_ratio.set(round(hits / total, 4))
+        metrics = [self.query_seconds, self.query_rows, self.cache_requests, self.cache_hit_ratio, self.pdf_seconds,
+                   self.pool_checkouts, self.pool_wait_seconds, self.pool_checked_out, self.errors]
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+@st.cache_resource
+def get_metrics():
+    return ReportMetrics()
+
+# 记录PDF生成耗时和失败次数
+def record_pdf_metrics(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            get_metrics().errors.inc(kind='pdf', error=type(e).__name__)
+            raise
+        finally:
+            get_metrics().pdf_seconds.observe(time.time() - started)
+    return wrapper
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = get_metrics().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# 定期将指标写入文件(供node_exporter的textfile收集器读取)
+def write_metrics_file(path, interval):
+    while True:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(get_metrics().render())
+        os.replace(path + '.tmp', path)
+        time.sleep(interval)
+
+# 启动指标输出([Metrics] port 提供 /metrics 接口，[Metrics] file 定期写文件)，每个进程只启动一次
+@st.cache_resource
+def start_metrics_exporter():
+    config = load_config()
+    port = config.getint('Metrics', 'port', fallback=0)
+    if port:
+        # 端口已被占用(例如同一台机器上运行了多个Streamlit进程)时只记录错误，不影响页面；
+        # cache_resource不缓存异常，这里不捕获的话每次重跑都会再次报错
+        try:
+            server = ThreadingHTTPServer((config.get('Metrics', 'host', fallback='0.0.0.0'), port), MetricsHandler)
+        except OSError as e:
+            print(f"Failed to serve metrics on port {port}: {e}")
+        else:
+            threading.Thread(target=server.serve_forever, name='itop-metrics-http', daemon=True).start()
+            print(f"Serving metrics on port {port}")
+    path = config.get('Metrics', 'file', fallback='')
+    if path:
+        interval = config.getint('Metrics', 'interval', fallback=15)
+        threading.Thread(target=write_metrics_file, args=(path, interval), name='itop-metrics-file', daemon=True).start()
+        print(f"Writing metrics to {path} every {interval}s")
+    return True
+
+# 新连接上设置服务端的单条查询超时：MySQL使用MAX_EXECUTION_TIME(毫秒)，
+# MariaDB没有该变量，使用max_statement_time(秒)
+def set_statement_timeout(dbapi_connection, timeout):
+    if 'MariaDB' in dbapi_connection.get_server_info():
+        statement = f"SET SESSION max_statement_time = {timeout:g}"
+    else:
+        statement = f"SET SESSION MAX_EXECUTION_TIME = {int(timeout * 1000)}"
+    with dbapi_connection.cursor() as cursor:
+        cursor.execute(statement)
+
+# 创建数据库连接池，服务端(MAX_EXECUTION_TIME/max_statement_time)和客户端(read_timeout)都限制单条查询的执行时间
+def create_db_engine(section, defaults):
+    db_host = section['host']
+    db_user = section.get('user', defaults['user'])
+    db_password = section.get('password', defaults['password'])
+    db_port = section.get('port', defaults['port'])
+    db_name = section.get('database', defaults['database'])
+
+    timeout = get_query_timeout()
+    connect_args = {'connect_timeout': 5}
+    if timeout > 0:
+        connect_args['read_timeout'] = int(timeout) + 5
+    engine = create_engine(
+        f'mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}',
+        pool_pre_ping=True,
+        connect_args=connect_args
+    )
+    if timeout > 0:
+        event.listen(engine, 'connect', lambda dbapi_connection, connection_record: set_statement_timeout(dbapi_connection, timeout))
+    get_metrics().watch_pool(db_host, engine)
+    return engine
+
+# 单条查询的超时时间(秒)，0表示不限制
+def get_query_timeout():
+    return load_config().getfloat('Query', 'timeout', fallback=60)
+
+# 报表查询路由：配置了只读副本时优先使用副本，副本不可用时回退到主库
+class DatabaseRouter:
+    def __init__(self, primary, replica, retry_interval):
+        self.primary = primary
+        self.replica = replica
+        self.retry_interval = retry_interval
+        self.replica_down_until = 0
+
+    def reporting_engine(self):
+        if self.replica is not None and time.time() >= self.replica_down_until:
+            return self.replica
+        return self.primary
+
+    def mark_replica_down(self):
+        self.replica_down_until = time.time() + self.retry_interval
+
+@st.cache_resource
+def get_db_router():
+    # 从配置文件读取数据库连接信息    
+    config = load_config()
+    primary = create_db_engine(config['Database'], config['Database'])
+    replica = None
+    if config.has_section('Replica'):
+        replica = create_db_engine(config['Replica'], config['Database'])
+    return DatabaseRouter(primary, replica, config.getint('Replica', 'retry_interval', fallback=60))
+
+# 连接到iTop数据库(返回报表查询使用的连接池)
+def connect_to_itop_db():
+    return get_db_router().reporting_engine()
+
+# 查询超时
+class QueryTimeoutError(Exception):
+    pass
+
+# 执行查询的后台线程池，Streamlit脚本线程在等待结果期间仍可响应重跑
+@st.cache_resource
+def get_query_executor():
+    return ThreadPoolExecutor(max_workers=load_config().getint('Query', 'workers', fallback=16), thread_name_prefix='itop-query')
+
+# 终止指定连接上正在执行的查询
+def kill_query(engine, connection_id):
+    try:
+        with engine.connect() as connection:
+            connection.exec_driver_sql(f"KILL QUERY {int(connection_id)}")
+        print(f"Killed query on connection {connection_id}")
+    except Exception as e:
+        print(f"Failed to kill query on connection {connection_id}: {e}")
+
+# 向页面发送一条空的更新。Streamlit在发送时检查是否有新的重跑请求，
+# 有则抛出重跑异常，借此中断对已过时查询的等待
+def query_checkpoint(state):
+    if get_script_run_ctx() is None:
+        return
+    if 'placeholder' not in state:
+        state['placeholder'] = st.empty()
+    state['placeholder'].empty()
+
+# 在后台线程中执行查询：超时或页面重跑时终止数据库端的查询
+def run_query(engine, query, params):
+    timeout = get_query_timeout()
+    connect_started = time.time()
+    with engine.connect() as connection:
+        get_metrics().pool_wait_seconds.observe(time.time() - connect_started)
+        connection_id = connection.exec_driver_sql("SELECT CONNECTION_ID()").scalar()
+        future = get_query_executor().submit(pd.read_sql, query, connection, params=params)
+        started = time.time()
+        state = {}
+        try:
+            while True:
+                try:
+                    return future.result(timeout=0.5)
+                except FutureTimeoutError:
+                    if timeout > 0 and time.time() - started > timeout:
+                        raise QueryTimeoutError(f"查询执行超过 {timeout:g} 秒，已终止")
+                    query_checkpoint(state)
+                except OperationalError as e:
+                    # 服务端超时(MAX_EXECUTION_TIME/max_statement_time)先于客户端计时终止查询时，同样按查询超时处理
+                    if is_server_timeout_error(e):
+                        raise QueryTimeoutError(f"查询执行超过 {timeout:g} 秒，已被数据库终止") from e
+                    raise
+        except BaseException:
+            if not future.done():
+                kill_query(engine, connection_id)
+                # 等待后台线程退出后再归还连接；仍未退出时后台线程还在读取该连接，
+                # 作废连接而不是放回连接池，避免被其他查询取用
+                _, pending = wait([future], timeout=10)
+                if pending:
+                    connection.invalidate()
+            raise
+
+# 是否为连接类错误(只读副本不可用时回退到主库，查询超时等错误不回退)
+def is_connection_error(error):
+    orig = getattr(error, 'orig', None)
+    code = orig.args[0] if orig is not None and orig.args else None
+    return code in (2002, 2003, 2005, 2006, 2013)
+
+# 是否为服务端终止查询的错误(3024: 超过MAX_EXECUTION_TIME，1969: 超过MariaDB的max_statement_time，1317: 查询被中断)
+def is_server_timeout_error(error):
+    orig = getattr(error, 'orig', None)
+    code = orig.args[0] if orig is not None and orig.args else None
+    return code in (3024, 1969, 1317)
+
+# 查询结果缓存：按SQL和参数缓存查询结果，超过ttl秒后重新查询；
+# 最多保留max_entries个结果，超出时按最近使用顺序淘汰
+class QueryResultCache:
+    def __init__(self, ttl, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # 带水位线的结果只在水位线不变时有效，不受有效期限制；其余结果按有效期判断
+    def get(self, key, watermark=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self.is_valid(entry, watermark):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            # 返回副本，避免调用方修改缓存中的数据
+            return entry[1].copy()
+
+    def is_valid(self, entry, watermark):
+        if self.ttl <= 0:
+            return False
+        if watermark is not None:
+            return entry[2] == watermark
+        return time.time() - entry[0] <= self.ttl
+
+    def put(self, key, df, watermark=None):
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            # 顺便清理已过期的结果(带水位线的结果在下次校验失败时被覆盖)
+            for expired in [k for k, (ts, _, mark) in self._entries.items() if mark is None and now - ts > self.ttl]:
+                del self._entries[expired]
+            self._entries[key] = (now, df.copy(), watermark)
+            self._entries.move_to_end(key)
+            # 带水位线的结果不会过期，各周期的结果都会一直保留，由数量上限淘汰最久未使用的
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# 磁盘查询缓存：多个Streamlit进程共用同一缓存目录，每个结果保存为一个未压缩的Arrow IPC文件，
+# 读取时内存映射，各进程共享操作系统的页缓存，不必各自查询数据库；
+# 写入先写临时文件再重命名，保证其他进程不会读到写了一半的文件；
+# 总大小超过上限时按最近访问时间淘汰(命中时更新文件的访问时间)
+class DiskResultCache:
+    SUFFIX = '.arrow'
+
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + self.SUFFIX)
+
+    def get(self, key, watermark=None):
+        path = self.path_for(key)
+        try:
+            modified = os.path.getmtime(path)
+            if self.ttl <= 0 or (watermark is None and time.time() - modified > self.ttl):
+                self.misses += 1
+                return None
+            with pa.memory_map(path, 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+            # 文件名是键的哈希，再核对一次完整的键；带水位线时核对水位线
+            metadata = table.schema.metadata or {}
+            if metadata.get(b'itop_cache_key') != repr(key).encode('utf-8') or (
+                    watermark is not None and metadata.get(b'itop_cache_watermark') != watermark.encode('utf-8')):
+                self.misses += 1
+                return None
+            os.utime(path, (time.time(), modified))
+        except (OSError, pa.ArrowException):
+            # 不存在、已被其他进程淘汰或文件损坏，都按未命中处理
+            self.misses += 1
+            return None
+        self.hits += 1
+        return table.to_pandas()
+
+    def put(self, key, df, watermark=None):
+        if self.ttl <= 0:
+            return
+        table = dataframe_to_arrow(df)
+        metadata = {**(table.schema.metadata or {}), b'itop_cache_key': repr(key).encode('utf-8')}
+        if watermark is not None:
+            metadata[b'itop_cache_watermark'] = watermark.encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+        path = self.path_for(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with pa.ipc.new_file(f, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+                # 进程中途退出留下的临时文件
+                if name.endswith('.tmp') and now - stat.st_mtime > 3600:
+                    os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            if name.endswith(self.SUFFIX):
+                entries.append((stat.st_atime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                # 已被其他进程删除，或在Windows上正被映射，下次再淘汰
+                continue
+            total -= size
+
+# 缓存对象放在st.cache_resource中，跨Streamlit重跑和会话共享；
+# 配置了[Cache] dir(默认cache)时使用磁盘缓存，设为空则只在进程内缓存
+@st.cache_resource
+def get_result_cache():
+    config = load_config()
+    ttl = config.getint('Cache', 'ttl', fallback=600)
+    directory = config.get('Cache', 'dir', fallback='cache')
+    if not directory:
+        return QueryResultCache(ttl, config.getint('Cache', 'max_entries', fallback=256))
+    return DiskResultCache(directory, ttl, config.getint('Cache', 'max_size_mb', fallback=512) * 1024 * 1024)
+
+# 执行SQL查询(只读副本不可用时切换到主库)，记录耗时、行数和错误指标
+def query_database(engine, query, params, name):
+    metrics = get_metrics()
+    print("Executing query:", query)
+    print("With parameters:", params)
     
-    db_host = config['Database']['host']
-    db_user = config['Database']['user']
-    db_password = config['Database']['password']
-    db_port = config['Database']['port']
-    db_name = config['Database']['database']
-    
-    return create_engine(f'mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}')
+    started = time.time()
+    try:
+        try:
+            df = run_query(engine, query, params)
+        except OperationalError as e:
+            if not is_connection_error(e):
+                raise
+            router = get_db_router()
+            if engine is not router.replica:
+                raise
+            print(f"Read replica unavailable, falling back to primary: {e}")
+            router.mark_replica_down()
+            df = run_query(router.primary, query, params)
+    except Exception as e:
+        metrics.errors.inc(kind='query', error=type(e).__name__)
+        raise
+    metrics.query_seconds.observe(time.time() - started, query=name)
+    metrics.query_rows.observe(len(df), query=name)
+    return df
+
+# 周期水位线：周期内工单的最后更新时间和数量，任何工单被修改、新建或删除都会改变水位线；
+# 只访问ticket表的start_date范围，建议建立(start_date, last_update)索引，使其只扫描索引
+def get_period_watermark(engine, start_date, end_date):
+    query = """
+    SELECT MAX(t.last_update) AS last_update, COUNT(*) AS tickets
+    FROM ticket t
+    WHERE t.start_date >= %(start_date)s
+    AND t.start_date < %(end_date)s
+    """
+    df = query_database(engine, query, {'start_date': str(start_date), 'end_date': str(end_date)}, 'get_period_watermark')
+    return f"{df['last_update'].iloc[0]}|{int(df['tickets'].iloc[0])}"
+
+# 同一周期的水位线在probe_interval秒内只探测一次，一次页面重跑中的多个查询共用一次探测
+class WatermarkProbe:
+    def __init__(self, interval):
+        self.interval = interval
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def get(self, engine, start_date, end_date):
+        key = (str(engine.url), str(start_date), str(end_date))
+        with self._lock:
+            entry = self._marks.get(key)
+        if entry is not None and time.time() - entry[0] <= self.interval:
+            return entry[1]
+        watermark = get_period_watermark(engine, start_date, end_date)
+        with self._lock:
+            self._marks[key] = (time.time(), watermark)
+        return watermark
+
+@st.cache_resource
+def get_watermark_probe():
+    return WatermarkProbe(load_config().getfloat('Cache', 'probe_interval', fallback=5))
 
 # 执行SQL查询并返回DataFrame
-def execute_query(engine, query, params):
+# 按周期查询的结果带有该周期的水位线，水位线不变时直接使用缓存，变化后重新查询；
+# 结果还依赖周期外工单的查询(watermark=False)仍按缓存有效期判断
+def execute_query(engine, query, params, name='query', watermark=True):
     # 将日期转换为字符串格式
     for key, value in params.items():
         if isinstance(value, (date, datetime)):
             params[key] = value.strftime('%Y-%m-%d')
-    
-    print("Executing query:", query)
-    print("With parameters:", params)
-    
-    with engine.connect() as connection:
-        df = pd.read_sql(query, connection, params=params)
+
+    cache = get_result_cache()
+    cache_key = (query, tuple(sorted(params.items())))
+    mark = None
+    if watermark and cache.ttl > 0 and 'start_date' in params and 'end_date' in params:
+        mark = get_watermark_probe().get(engine, params['start_date'], params['end_date'])
+    df = cache.get(cache_key, mark)
+    metrics = get_metrics()
+    metrics.cache_requests.inc(result='miss' if df is None else 'hit')
+    if df is not None:
+        return df
+
+    df = query_database(engine, query, params, name)
+    cache.put(cache_key, df, mark)
     return df
 
 # 1. 工单统计
@@ -67,7 +580,7 @@ def get_ticket_summary(engine, start_date, end_date):
     AND t.start_date < %(end_date)s
     AND (tr.status <> 'new' OR ti.status <> 'new' OR c.status <> 'new')
     """
-    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date})
+    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_ticket_summary')
 
 # 2. 服务请求状态统计
 def get_user_request_stats(engine, start_date, end_date):
@@ -83,7 +596,7 @@ def get_user_request_stats(engine, start_date, end_date):
     AND t.start_date < %(end_date)s
     AND tr.status <> 'new'
     """
-    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date})
+    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_user_request_stats')
 
 # 3. 事件状态统计
 def get_incident_stats(engine, start_date, end_date):
@@ -99,7 +612,7 @@ def get_incident_stats(engine, start_date, end_date):
     AND t.start_date < %(end_date)s
     AND ti.status <> 'new'
     """
-    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date})
+    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_incident_stats')
 
 # 4. 变更状态统计
 def get_change_stats(engine, start_date, end_date):
@@ -115,7 +628,7 @@ def get_change_stats(engine, start_date, end_date):
     AND t.start_date < %(end_date)s
     AND c.status <> 'new'
     """
-    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date})
+    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_change_stats')
 
 # 5. 按团队统计处理时长
 def get_team_stats(engine, start_date, end_date):
@@ -210,7 +723,7 @@ def get_team_stats(engine, start_date, end_date):
     ORDER BY DATE_FORMAT(subquery.start_date, '%%Y-%%m') DESC, subquery.ticket_type DESC, c.name
     """
     
-    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date})
+    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_team_stats')
 
 # 6. 按人员统计处理时长
 def get_person_stats(engine, start_date, end_date):
@@ -309,7 +822,7 @@ def get_person_stats(engine, start_date, end_date):
     ORDER BY DATE_FORMAT(start_date, '%%Y-%%m') DESC, ticket_type DESC, ai.agent_name
     """
 
-    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date})
+    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_person_stats')
 
 # 7. 未解决的工单
 def get_unresolved_tickets(engine, start_date, end_date):
@@ -339,43 +852,944 @@ def get_unresolved_tickets(engine, start_date, end_date):
     AND t.start_date >= %(start_date)s
     AND t.start_date < %(end_date)s
     """
-    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date})
+    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_unresolved_tickets')
 
-# 8. 超时工单
+# 8. 超时工单：服务请求和事件中触发SLA预警(75%)或超时(100%)的工单，每个工单一行；
+# 两个分支都先按t.start_date范围过滤，SLA标志位使用"= 1"比较，保证可以使用索引
 def get_overdue_tickets(engine, start_date, end_date):
     query = """
     SELECT 
-        (CASE WHEN tr.status THEN CAST(CONCAT(COALESCE(t.ref, '')) AS CHAR) ELSE NULL END) AS '工单号', 
-        t.title AS '标题',
-        tr.status AS '状态', 
-        t.start_date AS '开始日期',
-        t.last_update AS '最后日期',
-        ROUND(tr.tto_100_overrun / 60,2) AS '响应时间超过(分钟)',
-        ROUND(tr.ttr_100_overrun / 60,2) AS '解决时间超过(分钟)',
-        (CASE WHEN tr.status THEN CAST(CONCAT(COALESCE(c1.name, ''), COALESCE(' ', ''), COALESCE(p1.first_name, '')) AS CHAR) ELSE NULL END) AS '发起人', 
-        (CASE WHEN tr.status THEN CAST(CONCAT(COALESCE(c2.name, '')) AS CHAR) ELSE NULL END) AS '团队名称', 
-        (CASE WHEN tr.status THEN CAST(CONCAT(COALESCE(c1.name, ''), COALESCE(' ', ''), COALESCE(p1.first_name, '')) AS CHAR) ELSE NULL END) AS '办理人',
-        tr.assignment_date AS '实际响应时间',
-        tr.resolution_date AS '实际解决时间',
-        tr.tto_100_deadline AS '响应最后期限',
-        tr.ttr_100_deadline AS '解决最后期限',
-        ROUND(AVG(TIMESTAMPDIFF(SECOND,tr.tto_started,tr.tto_stopped) / 60),2) AS '响应时长(分钟)' , 
-        ROUND(AVG(TIMESTAMPDIFF(SECOND,tr.tto_stopped,tr.ttr_stopped) / 60),2) AS '解决时长(分钟)'
-    FROM ticket t 
-    LEFT JOIN ticket_request tr ON tr.id = t.id 
-    LEFT JOIN ( person AS p INNER JOIN contact AS c ON p.id = c.id ) ON tr.approver_id = p.id 
-    LEFT JOIN ( person AS p1 INNER JOIN contact AS c1 ON p1.id = c1.id ) ON t.agent_id = p1.id 
-    LEFT JOIN contact AS c2 ON t.team_id = c2.id 
-    WHERE t.finalclass <> 'Problem' 
-    AND ( tr.tto_75_passed = 1 or tr.ttr_75_passed )
-    AND t.start_date >= %(start_date)s
-    AND t.start_date < %(end_date)s
-    GROUP BY tr.status
-    HAVING COUNT(*) > 0
+        o.ref AS '工单号', 
+        o.ticket_type AS '工单类型',
+        o.title AS '标题',
+        o.status AS '状态', 
+        o.start_date AS '开始日期',
+        o.last_update AS '最后日期',
+        ROUND(o.tto_100_overrun / 60, 2) AS '响应时间超过(分钟)',
+        ROUND(o.ttr_100_overrun / 60, 2) AS '解决时间超过(分钟)',
+        CONCAT(COALESCE(cc.name, ''), ' ', COALESCE(cp.first_name, '')) AS '发起人', 
+        tc.name AS '团队名称', 
+        CONCAT(COALESCE(ac.name, ''), ' ', COALESCE(ap.first_name, '')) AS '办理人',
+        o.assignment_date AS '实际响应时间',
+        o.resolution_date AS '实际解决时间',
+        o.tto_100_deadline AS '响应最后期限',
+        o.ttr_100_deadline AS '解决最后期限',
+        ROUND(TIMESTAMPDIFF(SECOND, o.tto_started, o.tto_stopped) / 60, 2) AS '响应时长(分钟)', 
+        ROUND(TIMESTAMPDIFF(SECOND, o.tto_stopped, o.ttr_stopped) / 60, 2) AS '解决时长(分钟)'
+    FROM (
+        SELECT 
+            t.ref, '服务请求' AS ticket_type, t.title, tr.status, t.start_date, t.last_update,
+            t.caller_id, t.team_id, t.agent_id,
+            tr.tto_100_overrun, tr.ttr_100_overrun, tr.assignment_date, tr.resolution_date,
+            tr.tto_100_deadline, tr.ttr_100_deadline, tr.tto_started, tr.tto_stopped, tr.ttr_stopped
+        FROM ticket t 
+        JOIN ticket_request tr ON tr.id = t.id 
+        WHERE t.start_date >= %(start_date)s
+            AND t.start_date < %(end_date)s
+            AND (tr.tto_75_passed = 1 OR tr.ttr_75_passed = 1 OR tr.tto_100_passed = 1 OR tr.ttr_100_passed = 1)
+        
+        UNION ALL
+        
+        SELECT 
+            t.ref, '事件' AS ticket_type, t.title, ti.status, t.start_date, t.last_update,
+            t.caller_id, t.team_id, t.agent_id,
+            ti.tto_100_overrun, ti.ttr_100_overrun, ti.assignment_date, ti.resolution_date,
+            ti.tto_100_deadline, ti.ttr_100_deadline, ti.tto_started, ti.tto_stopped, ti.ttr_stopped
+        FROM ticket t 
+        JOIN ticket_incident ti ON ti.id = t.id 
+        WHERE t.start_date >= %(start_date)s
+            AND t.start_date < %(end_date)s
+            AND (ti.tto_75_passed = 1 OR ti.ttr_75_passed = 1 OR ti.tto_100_passed = 1 OR ti.ttr_100_passed = 1)
+    ) AS o
+    LEFT JOIN (person cp JOIN contact cc ON cp.id = cc.id) ON o.caller_id = cp.id 
+    LEFT JOIN (person ap JOIN contact ac ON ap.id = ac.id) ON o.agent_id = ap.id 
+    LEFT JOIN contact tc ON o.team_id = tc.id 
+    ORDER BY o.start_date, o.ref
+    """
+    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_overdue_tickets')
+
+# 解析日期列表，支持单个日期(2025-01-01)和日期范围(2025-01-28~2025-02-04)，以逗号或换行分隔
+def parse_date_list(value):
+    dates = []
+    for item in value.replace('\n', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition('~')
+        first = np.datetime64(first.strip(), 'D')
+        last = np.datetime64(last.strip(), 'D') if last else first
+        dates.append(np.arange(first, last + 1))
+    return np.concatenate(dates) if dates else np.array([], dtype='datetime64[D]')
+
+# 解析时刻(09:00)为当天的秒数
+def parse_clock(value):
+    hours, minutes = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60
+
+# 工作日历：[SLA] business_hours开启时，处理时长只计工作日的工作时段，节假日不计，调休上班日照常计算
+def load_work_calendar():
+    config = load_config()
+    if not config.getboolean('SLA', 'business_hours', fallback=False):
+        return None
+    weekmask = [0] * 7
+    for day in config.get('SLA', 'workdays', fallback='1,2,3,4,5').split(','):
+        weekmask[int(day) - 1] = 1
+    return {
+        'periods': [
+            tuple(parse_clock(clock) for clock in item.split('-'))
+            for item in config.get('SLA', 'work_hours', fallback='09:00-12:00,13:30-18:00').split(',')
+        ],
+        'weekmask': weekmask,
+        'holidays': parse_date_list(config.get('SLA', 'holidays', fallback='')),
+        'extra_workdays': parse_date_list(config.get('SLA', 'extra_workdays', fallback='')),
+    }
+
+# 按工作日历计算开始到结束之间的工作时长(秒)，对整列时间向量化计算。
+# 先求出每一天之前累计的工作秒数，任一时刻的累计工作秒数 = 当天之前的累计 + 当天已过的工作时段，
+# 两个时刻的累计值相减即为工作时长。任一端为空时结果为NaN
+def business_seconds(starts, ends, calendar):
+    starts = pd.to_datetime(starts).values.astype('datetime64[s]')
+    ends = pd.to_datetime(ends).values.astype('datetime64[s]')
+    result = np.full(len(starts), np.nan)
+    valid = ~(np.isnat(starts) | np.isnat(ends))
+    if not valid.any():
+        return result
+    starts, ends = starts[valid], ends[valid]
+
+    first_day = min(starts.min(), ends.min()).astype('datetime64[D]')
+    last_day = max(starts.max(), ends.max()).astype('datetime64[D]')
+    days = np.arange(first_day, last_day + 1)
+    workday = np.is_busday(days, weekmask=calendar['weekmask'], holidays=calendar['holidays'])
+    workday |= np.isin(days, calendar['extra_workdays'])
+    daily_seconds = sum(end - begin for begin, end in calendar['periods'])
+    worked_before = np.concatenate([[0], np.cumsum(workday * daily_seconds)])
+
+    def worked_until(moments):
+        day = moments.astype('datetime64[D]')
+        index = (day - first_day).astype(np.int64)
+        seconds = (moments - day).astype(np.int64)
+        today = sum(np.clip(seconds - begin, 0, end - begin) for begin, end in calendar['periods'])
+        return worked_before[index] + workday[index] * today
+
+    result[valid] = np.maximum(worked_until(ends) - worked_until(starts), 0)
+    return result
+
+# 用工作时长替换团队/人员统计中的平均和最大处理时长(变更的响应时长保持N/A)
+def apply_business_hours(stats, facts, name_column, fact_name_column):
+    if stats.empty or facts.empty:
+        return stats
+    grouped = facts.assign(month=pd.to_datetime(facts['start_date']).dt.strftime('%Y-%m')).groupby(['month', fact_name_column, 'ticket_type'])
+    durations = pd.DataFrame({
+        '平均响应时长(分钟)': grouped['response_time'].mean() / 60,
+        '平均解决时长(分钟)': grouped['resolution_time'].mean() / 60,
+        '最大响应时长(分钟)': grouped['response_time'].max() / 60,
+        '最大解决时长(分钟)': grouped['resolution_time'].max() / 60,
+    }).round(2)
+    durations.index.names = ['月份', name_column, '工单类型']
+    adjusted = stats.set_index(['月份', name_column, '工单类型'])
+    adjusted = adjusted.astype({column: object for column in durations.columns})
+    adjusted.update(durations)
+    return adjusted.reset_index()[stats.columns]
+
+# 9. 工单明细(每个工单一行，供环比对比、逐级钻取等按团队/人员的汇总使用)
+def get_ticket_facts(engine, start_date, end_date):
+    query = """
+    SELECT 
+        f.ticket_id,
+        f.ref,
+        f.title,
+        f.start_date,
+        f.ticket_type,
+        f.status,
+        f.team_id,
+        tc.name AS team_name,
+        f.agent_id,
+        CONCAT(COALESCE(ac.name, ''), ' ', COALESCE(ap.first_name, '')) AS agent_name,
+        f.org_id,
+        og.name AS org_name,
+        f.service_id,
+        sv.name AS service_name,
+        f.tto_75_passed,
+        f.ttr_75_passed,
+        f.tto_100_passed,
+        f.ttr_100_passed,
+        f.response_time,
+        f.resolution_time,
+        f.response_start,
+        f.response_end,
+        f.resolution_start,
+        f.resolution_end
+    FROM (
+        SELECT 
+            t.id AS ticket_id,
+            t.ref,
+            t.title,
+            t.start_date,
+            '服务请求' AS ticket_type,
+            tr.status,
+            t.team_id,
+            t.agent_id,
+            t.org_id,
+            tr.service_id,
+            tr.tto_75_passed,
+            tr.ttr_75_passed,
+            tr.tto_100_passed,
+            tr.ttr_100_passed,
+            TIMESTAMPDIFF(SECOND, tr.tto_started, tr.tto_stopped) AS response_time,
+            TIMESTAMPDIFF(SECOND, tr.tto_stopped, tr.ttr_stopped) AS resolution_time,
+            tr.tto_started AS response_start,
+            tr.tto_stopped AS response_end,
+            tr.tto_stopped AS resolution_start,
+            tr.ttr_stopped AS resolution_end
+        FROM ticket t 
+        JOIN ticket_request tr ON tr.id = t.id 
+        WHERE tr.status <> 'new'
+            AND t.start_date >= %(start_date)s
+            AND t.start_date < %(end_date)s
+        
+        UNION ALL
+        
+        SELECT 
+            t.id AS ticket_id,
+            t.ref,
+            t.title,
+            t.start_date,
+            '事件' AS ticket_type,
+            ti.status,
+            t.team_id,
+            t.agent_id,
+            t.org_id,
+            ti.service_id,
+            ti.tto_75_passed,
+            ti.ttr_75_passed,
+            ti.tto_100_passed,
+            ti.ttr_100_passed,
+            TIMESTAMPDIFF(SECOND, ti.tto_started, ti.tto_stopped) AS response_time,
+            TIMESTAMPDIFF(SECOND, ti.tto_stopped, ti.ttr_stopped) AS resolution_time,
+            ti.tto_started AS response_start,
+            ti.tto_stopped AS response_end,
+            ti.tto_stopped AS resolution_start,
+            ti.ttr_stopped AS resolution_end
+        FROM ticket t 
+        JOIN ticket_incident ti ON ti.id = t.id
+        WHERE ti.status <> 'new'
+            AND t.start_date >= %(start_date)s
+            AND t.start_date < %(end_date)s
+        
+        UNION ALL
+        
+        SELECT 
+            t.id AS ticket_id,
+            t.ref,
+            t.title,
+            t.start_date,
+            '变更' AS ticket_type,
+            c2.status,
+            t.team_id,
+            t.agent_id,
+            t.org_id,
+            NULL AS service_id,  -- 变更没有关联服务
+            0 AS tto_75_passed,  -- 变更工单没有响应时间要求
+            0 AS ttr_75_passed,  -- 变更工单暂不考虑解决时间超时
+            0 AS tto_100_passed,
+            0 AS ttr_100_passed,
+            NULL AS response_time,
+            TIMESTAMPDIFF(SECOND, t.start_date, t.end_date) AS resolution_time,
+            NULL AS response_start,
+            NULL AS response_end,
+            t.start_date AS resolution_start,
+            t.end_date AS resolution_end
+        FROM ticket t 
+        JOIN `change` c2 ON c2.id = t.id
+        WHERE c2.status <> 'new'
+            AND t.start_date >= %(start_date)s
+            AND t.start_date < %(end_date)s
+    ) AS f
+    LEFT JOIN contact tc ON f.team_id = tc.id AND tc.finalclass = 'Team'
+    LEFT JOIN (person ap JOIN contact ac ON ap.id = ac.id) ON f.agent_id = ap.id
+    LEFT JOIN organization og ON og.id = f.org_id
+    LEFT JOIN service sv ON sv.id = f.service_id
     """
-    return execute_query(engine, query, {'start_date': start_date, 'end_date': end_date})
+    facts = execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, 'get_ticket_facts')
+    # iTop中未指定的外键为0，统一按0处理便于建立索引
+    for col in ['team_id', 'agent_id', 'org_id', 'service_id']:
+        facts[col] = pd.to_numeric(facts[col], errors='coerce').fillna(0).astype('int64')
+    facts['team_name'] = facts['team_name'].fillna('未分配')
+    facts['agent_name'] = facts['agent_name'].where(facts['agent_id'] != 0, '未分配')
+    for col in ['response_time', 'resolution_time']:
+        facts[col] = pd.to_numeric(facts[col], errors='coerce')
+    # 按工作日历重新计算处理时长
+    calendar = load_work_calendar()
+    if calendar is not None:
+        facts['response_time'] = business_seconds(facts['response_start'], facts['response_end'], calendar)
+        facts['resolution_time'] = business_seconds(facts['resolution_start'], facts['resolution_end'], calendar)
+    return facts
+
+# 按团队/人员等维度汇总工单明细：数量、解决率、及时率以及平均和分位数处理时长
+def compute_period_aggregates(facts, by):
+    df = facts.assign(
+        unresolved=~facts['status'].isin(['closed', 'new', 'resolved']),
+        overdue=(facts['tto_75_passed'] == 1) | (facts['ttr_75_passed'] == 1),
+        response_minutes=facts['response_time'] / 60,
+        resolution_minutes=facts['resolution_time'] / 60,
+    )
+    grouped = df.groupby(by)
+    return pd.DataFrame({
+        '工单数量': grouped.size(),
+        '工单解决率(%)': (1 - grouped['unresolved'].mean()) * 100,
+        '工单及时率(%)': (1 - grouped['overdue'].mean()) * 100,
+        '平均响应时长(分钟)': grouped['response_minutes'].mean(),
+        'P90响应时长(分钟)': grouped['response_minutes'].quantile(0.9),
+        '平均解决时长(分钟)': grouped['resolution_minutes'].mean(),
+        'P50解决时长(分钟)': grouped['resolution_minutes'].quantile(0.5),
+        'P90解决时长(分钟)': grouped['resolution_minutes'].quantile(0.9),
+    }).round(2)
+
+# 指定月份在报表中的服务周期(开始日期为1日，结束日期为月末)
+def month_period(month_start):
+    month_start = month_start.replace(day=1)
+    return month_start, month_start.replace(day=calendar.monthrange(month_start.year, month_start.month)[1])
+
+# 获取指定月份的汇总数据，优先使用预热的工单明细，其次由查询缓存复用
+# (与页面使用同一周期和查询参数，页面已获取过的明细不会重复查询)
+def get_month_aggregates(engine, month_start):
+    start_date, end_date = month_period(month_start)
+    prewarmed = load_prewarmed(engine, start_date, end_date, ['ticket_facts'])
+    if prewarmed is not None:
+        facts = prewarmed['ticket_facts']
+    else:
+        facts = get_ticket_facts(engine, start_date, end_date)
+    return aggregate_month_facts(facts)
+
+# 由工单明细计算环比对比的汇总数据
+def aggregate_month_facts(facts):
+    return {
+        'type': pd.concat([
+            compute_period_aggregates(facts, 'ticket_type'),
+            compute_period_aggregates(facts.assign(ticket_type='合计'), 'ticket_type'),
+        ]).rename_axis('工单类型'),
+        'team': compute_period_aggregates(facts, 'team_name').rename_axis('团队'),
+        'agent': compute_period_aggregates(facts, 'agent_name').rename_axis('办理人'),
+    }
+
+# 环比指标：值为True表示越大越好，False表示越小越好，None表示不判断优劣
+COMPARE_METRICS = {
+    '工单数量': None,
+    '工单解决率(%)': True,
+    '工单及时率(%)': True,
+    '平均响应时长(分钟)': False,
+    'P90响应时长(分钟)': False,
+    '平均解决时长(分钟)': False,
+    'P50解决时长(分钟)': False,
+    'P90解决时长(分钟)': False,
+}
+
+# 对比两个周期的汇总数据，返回对比表和退步标记
+def compare_aggregates(current, previous):
+    current, previous = current.align(previous, join='outer')
+    compared = pd.DataFrame(index=current.index)
+    regressions = pd.DataFrame(False, index=current.index, columns=[])
+    for metric, higher_is_better in COMPARE_METRICS.items():
+        delta = (current[metric] - previous[metric]).round(2)
+        compared[metric] = current[metric]
+        compared[f'{metric}(上期)'] = previous[metric]
+        compared[f'{metric}变化'] = delta
+        if higher_is_better is None:
+            regressions[f'{metric}变化'] = False
+        else:
+            regressions[f'{metric}变化'] = (delta < 0) if higher_is_better else (delta > 0)
+    regressions = regressions.reindex(columns=compared.columns, fill_value=False)
+    return compared, regressions
+
+# 退步的指标标红显示
+def highlight_regressions(compared, regressions):
+    styles = pd.DataFrame(
+        np.where(regressions, 'background-color: #f6416c; color: white', ''),
+        index=compared.index, columns=compared.columns
+    )
+    return compared.style.format(precision=2, na_rep='-').apply(lambda _: styles, axis=None)
+
+# 建立按团队和办理人索引的工单明细，逐级钻取时直接按索引切片，不再访问数据库
+def index_ticket_facts(facts):
+    return facts.set_index(['team_id', 'agent_id']).sort_index()
+
+# SLA标记：达到100%为超时，达到75%为预警
+def sla_flag(passed_75, passed_100):
+    return np.select([passed_100 == 1, passed_75 == 1], ['超时', '预警'], default='正常')
+
+# 钻取到工单时展示的明细列
+def format_drill_tickets(tickets):
+    return pd.DataFrame({
+        '工单号': tickets['ref'],
+        '标题': tickets['title'],
+        '工单类型': tickets['ticket_type'],
+        '状态': tickets['status'],
+        '开始时间': tickets['start_date'],
+        '响应SLA': sla_flag(tickets['tto_75_passed'], tickets['tto_100_passed']),
+        '解决SLA': sla_flag(tickets['ttr_75_passed'], tickets['ttr_100_passed']),
+        '响应时长(分钟)': (tickets['response_time'] / 60).round(2),
+        '解决时长(分钟)': (tickets['resolution_time'] / 60).round(2),
+    }).sort_values('开始时间').reset_index(drop=True)
+
+# 10. 未解决工单趋势：周期内处于未解决状态的工单的开始和解决时间
+def backlog_open_since(start_date):
+    return start_date - timedelta(days=load_config().getint('Backlog', 'max_open_days', fallback=365))
+
+def get_ticket_lifecycle(engine, start_date, end_date):
+    query = """
+    SELECT 
+        f.ticket_type,
+        tc.name AS team_name,
+        f.agent_id,
+        CONCAT(COALESCE(ac.name, ''), ' ', COALESCE(ap.first_name, '')) AS agent_name,
+        f.opened_at,
+        f.closed_at
+    FROM (
+        SELECT 
+            '服务请求' AS ticket_type,
+            t.team_id,
+            t.agent_id,
+            t.start_date AS opened_at,
+            CASE WHEN tr.status IN ('closed', 'resolved') THEN COALESCE(tr.resolution_date, t.close_date, t.last_update) END AS closed_at
+        FROM ticket t 
+        JOIN ticket_request tr ON tr.id = t.id 
+        WHERE tr.status <> 'new'
+            AND t.start_date >= %(open_since)s
+            AND t.start_date < %(end_date)s
+            AND (tr.status NOT IN ('closed', 'resolved') OR COALESCE(tr.resolution_date, t.close_date, t.last_update) >= %(start_date)s)
+        
+        UNION ALL
+        
+        SELECT 
+            '事件' AS ticket_type,
+            t.team_id,
+            t.agent_id,
+            t.start_date AS opened_at,
+            CASE WHEN ti.status IN ('closed', 'resolved') THEN COALESCE(ti.resolution_date, t.close_date, t.last_update) END AS closed_at
+        FROM ticket t 
+        JOIN ticket_incident ti ON ti.id = t.id
+        WHERE ti.status <> 'new'
+            AND t.start_date >= %(open_since)s
+            AND t.start_date < %(end_date)s
+            AND (ti.status NOT IN ('closed', 'resolved') OR COALESCE(ti.resolution_date, t.close_date, t.last_update) >= %(start_date)s)
+        
+        UNION ALL
+        
+        SELECT 
+            '变更' AS ticket_type,
+            t.team_id,
+            t.agent_id,
+            t.start_date AS opened_at,
+            CASE WHEN c2.status IN ('closed', 'resolved') THEN COALESCE(t.end_date, t.close_date, t.last_update) END AS closed_at
+        FROM ticket t 
+        JOIN `change` c2 ON c2.id = t.id
+        WHERE c2.status <> 'new'
+            AND t.start_date >= %(open_since)s
+            AND t.start_date < %(end_date)s
+            AND (c2.status NOT IN ('closed', 'resolved') OR COALESCE(t.end_date, t.close_date, t.last_update) >= %(start_date)s)
+    ) AS f
+    LEFT JOIN contact tc ON tc.id = f.team_id
+    LEFT JOIN (person ap JOIN contact ac ON ap.id = ac.id) ON f.agent_id = ap.id
+    """
+    # 只统计周期开始前max_open_days天内创建的工单，使start_date上的条件可以走索引，不必扫描全部历史工单；
+    # 更早创建、至今仍未解决的工单不计入趋势
+    open_since = backlog_open_since(start_date)
+    # 结果包含周期开始前创建的工单，周期水位线反映不了它们的变化，仍按缓存有效期判断
+    params = {'start_date': start_date, 'end_date': end_date, 'open_since': open_since}
+    lifecycle = execute_query(engine, query, params, 'get_ticket_lifecycle', watermark=False)
+    lifecycle['agent_id'] = pd.to_numeric(lifecycle['agent_id'], errors='coerce').fillna(0).astype('int64')
+    lifecycle['team_name'] = lifecycle['team_name'].fillna('未分配')
+    lifecycle['agent_name'] = lifecycle['agent_name'].where(lifecycle['agent_id'] != 0, '未分配')
+    for col in ['opened_at', 'closed_at']:
+        lifecycle[col] = pd.to_datetime(lifecycle[col])
+    return lifecycle
+
+# 每日未解决工单数：每个工单在开始时+1、解决时-1，事件按(分组, 日期)归入桶中后沿日期累加，
+# 得到每天结束时各分组的未解决工单数；周期开始前的事件计入第一天，周期结束后的事件忽略
+def backlog_sweep(lifecycle, days, by=None):
+    if by is None:
+        codes, names = np.zeros(len(lifecycle), dtype='int64'), np.array(['全部'])
+    else:
+        codes, names = pd.factorize(lifecycle[by], sort=True)
+    day = pd.Timedelta(days=1)
+    opened = ((lifecycle['opened_at'] - days[0]) // day).clip(lower=0).to_numpy()
+    closed = ((lifecycle['closed_at'] - days[0]) // day).clip(lower=0).fillna(len(days)).to_numpy()
+    slots = np.concatenate([opened, closed]).astype('int64')
+    weights = np.concatenate([np.ones(len(opened)), -np.ones(len(closed))])
+    groups = np.concatenate([codes, codes])
+    in_range = slots < len(days)
+    counts = np.bincount(groups[in_range] * len(days) + slots[in_range], weights[in_range], minlength=len(names) * len(days))
+    return pd.DataFrame(counts.reshape(len(names), len(days)).cumsum(axis=1).T.astype('int64'), index=days, columns=names)
+
+# 每日未解决工单趋势(长表)：全部、按团队、按工程师(工程师在手工单数，不含未分配)
+def compute_backlog_curve(lifecycle, start_date, end_date):
+    days = pd.date_range(start_date, end_date, freq='D')
+    curves = [
+        ('全部', backlog_sweep(lifecycle, days)),
+        ('团队', backlog_sweep(lifecycle, days, 'team_name')),
+        ('办理人', backlog_sweep(lifecycle[lifecycle['agent_id'] != 0], days, 'agent_name')),
+    ]
+    frames = [curve.rename_axis('日期').rename_axis('名称', axis=1).stack().rename('未解决工单').reset_index().assign(维度=dimension)
+              for dimension, curve in curves]
+    return pd.concat(frames, ignore_index=True)[['日期', '维度', '名称', '未解决工单']]
+
+def get_backlog_curve(engine, start_date, end_date):
+    # 曲线按天统计到结束日期当天结束时，因此查询到结束日期的次日
+    lifecycle = get_ticket_lifecycle(engine, start_date, end_date + timedelta(days=1))
+    return compute_backlog_curve(lifecycle, start_date, end_date)
+
+# 工程师在手工单统计：按周期内每日的未解决工单数计算平均值和峰值
+def summarize_agent_workload(backlog_curve, top=None):
+    agents = backlog_curve[backlog_curve['维度'] == '办理人']
+    workload = agents.groupby('名称')['未解决工单'].agg(['mean', 'max']).round(1)
+    workload.columns = ['平均在手工单', '最大在手工单']
+    workload = workload.sort_values(['最大在手工单', '平均在手工单'], ascending=False).rename_axis('办理人').reset_index()
+    return workload.head(top) if top else workload
+
+# 11. 处理时长分布：按对数区间统计响应和解决时长，分桶和计数都在数据库中完成，只返回各区间的工单数
+# 区间0为小于min_minutes，区间i(i>=1)为[min_minutes*factor^(i-1), min_minutes*factor^i)，最后一个区间不设上限
+HISTOGRAM_DEFAULTS = {'min_minutes': 15, 'factor': 2, 'buckets': 10}
+
+def get_histogram_buckets():
+    config = load_config()
+    buckets = {
+        'min_minutes': config.getfloat('Histogram', 'min_minutes', fallback=HISTOGRAM_DEFAULTS['min_minutes']),
+        'factor': config.getfloat('Histogram', 'factor', fallback=HISTOGRAM_DEFAULTS['factor']),
+        'buckets': config.getint('Histogram', 'buckets', fallback=HISTOGRAM_DEFAULTS['buckets']),
+    }
+    # 至少需要两个区间，且区间上限必须逐个增大，否则无法分桶和生成区间名称，配置无效时使用默认值
+    if buckets['min_minutes'] <= 0 or buckets['factor'] <= 1 or buckets['buckets'] < 2:
+        print(f"Invalid [Histogram] settings {buckets}, using defaults {HISTOGRAM_DEFAULTS}")
+        return dict(HISTOGRAM_DEFAULTS)
+    return buckets
+
+def format_minutes(minutes):
+    if minutes < 60:
+        return f"{minutes:g}分钟"
+    if minutes < 1440:
+        return f"{minutes / 60:.3g}小时"
+    return f"{minutes / 1440:.3g}天"
+
+def histogram_bucket_labels(buckets):
+    edges = [buckets['min_minutes'] * buckets['factor'] ** i for i in range(buckets['buckets'] - 1)]
+    labels = [f"<{format_minutes(edges[0])}"]
+    labels += [f"{format_minutes(low)}-{format_minutes(high)}" for low, high in zip(edges, edges[1:])]
+    labels.append(f"≥{format_minutes(edges[-1])}")
+    return labels
+
+# 为分桶结果补充区间名称，并按工单类型、团队、指标、区间排序
+def label_histogram(histogram, buckets):
+    labels = histogram_bucket_labels(buckets)
+    histogram['区间序号'] = pd.to_numeric(histogram['区间序号']).astype('int64')
+    histogram['工单数'] = pd.to_numeric(histogram['工单数']).astype('int64')
+    histogram['区间'] = histogram['区间序号'].map(lambda i: labels[i])
+    return histogram.sort_values(['工单类型', '团队', '指标', '区间序号'], ascending=[False, True, False, True]).reset_index(drop=True)[
+        ['工单类型', '团队', '指标', '区间序号', '区间', '工单数']]
+
+def get_duration_histogram(engine, start_date, end_date):
+    buckets = get_histogram_buckets()
+    query = """
+    SELECT 
+        x.ticket_type AS '工单类型',
+        x.team_name AS '团队',
+        x.metric AS '指标',
+        CASE 
+            WHEN x.duration < %(min_seconds)s THEN 0
+            ELSE LEAST(FLOOR(LOG(x.duration / %(min_seconds)s) / LOG(%(factor)s)) + 1, %(last_bucket)s)
+        END AS '区间序号',
+        COUNT(*) AS '工单数'
+    FROM (
+        SELECT 
+            h.ticket_type,
+            COALESCE(c.name, '未分配') AS team_name,
+            m.metric,
+            CASE m.metric WHEN '响应时长' THEN h.response_time ELSE h.resolution_time END AS duration
+        FROM (
+            SELECT 
+                t.team_id,
+                '服务请求' AS ticket_type,
+                TIMESTAMPDIFF(SECOND, tr.tto_started, tr.tto_stopped) AS response_time,
+                TIMESTAMPDIFF(SECOND, tr.tto_stopped, tr.ttr_stopped) AS resolution_time
+            FROM ticket t 
+            JOIN ticket_request tr ON tr.id = t.id 
+            WHERE tr.status <> 'new'
+                AND t.start_date >= %(start_date)s
+                AND t.start_date < %(end_date)s
+            
+            UNION ALL
+            
+            SELECT 
+                t.team_id,
+                '事件' AS ticket_type,
+                TIMESTAMPDIFF(SECOND, ti.tto_started, ti.tto_stopped) AS response_time,
+                TIMESTAMPDIFF(SECOND, ti.tto_stopped, ti.ttr_stopped) AS resolution_time
+            FROM ticket t 
+            JOIN ticket_incident ti ON ti.id = t.id
+            WHERE ti.status <> 'new'
+                AND t.start_date >= %(start_date)s
+                AND t.start_date < %(end_date)s
+            
+            UNION ALL
+            
+            SELECT 
+                t.team_id,
+                '变更' AS ticket_type,
+                NULL AS response_time,  -- 变更工单没有响应时间要求
+                TIMESTAMPDIFF(SECOND, t.start_date, t.end_date) AS resolution_time
+            FROM ticket t 
+            JOIN `change` c2 ON c2.id = t.id
+            WHERE c2.status <> 'new'
+                AND t.start_date >= %(start_date)s
+                AND t.start_date < %(end_date)s
+        ) AS h
+        CROSS JOIN (SELECT '响应时长' AS metric UNION ALL SELECT '解决时长') AS m
+        LEFT JOIN contact c ON c.id = h.team_id
+    ) AS x
+    WHERE x.duration IS NOT NULL
+    GROUP BY x.ticket_type, x.team_name, x.metric, `区间序号`
+    """
+    params = {
+        'start_date': start_date,
+        'end_date': end_date,
+        'min_seconds': buckets['min_minutes'] * 60,
+        'factor': buckets['factor'],
+        'last_bucket': buckets['buckets'] - 1,
+    }
+    return label_histogram(execute_query(engine, query, params, 'get_duration_histogram'), buckets)
+
+# 开启工作日历时，由工单明细中的工作时长计算分布(分桶规则与数据库中一致)
+def histogram_from_facts(facts):
+    buckets = get_histogram_buckets()
+    durations = facts.melt(id_vars=['ticket_type', 'team_name'], value_vars=['response_time', 'resolution_time'],
+                           var_name='指标', value_name='duration').dropna(subset=['duration'])
+    min_seconds = buckets['min_minutes'] * 60
+    ratio = np.maximum(durations['duration'].to_numpy(dtype='float64'), min_seconds) / min_seconds
+    index = np.floor(np.log(ratio) / np.log(buckets['factor'])) + 1
+    durations['区间序号'] = np.where(durations['duration'] < min_seconds, 0, np.minimum(index, buckets['buckets'] - 1)).astype('int64')
+    durations['指标'] = durations['指标'].map({'response_time': '响应时长', 'resolution_time': '解决时长'})
+    histogram = durations.groupby(['ticket_type', 'team_name', '指标', '区间序号']).size().rename('工单数').reset_index()
+    return label_histogram(histogram.rename(columns={'ticket_type': '工单类型', 'team_name': '团队'}), buckets)
+
+# 12. 按客户组织和服务统计：分组统计在数据库中完成，每个组织或服务只返回一行，
+# 再取工单最多的前N个，其余合并为"其他"(不使用窗口函数，MySQL 5.7也可以执行)
+def get_breakdown_top():
+    return load_config().getint('Breakdown', 'top', fallback=10)
+
+# 组织和服务名称：维表很小且很少变化，整表查询一次后按缓存有效期缓存
+def get_dimension_names(engine, table):
+    if table not in ('organization', 'service'):
+        raise ValueError(f"不支持的维表: {table}")
+    names = execute_query(engine, f"SELECT id, name FROM {table}", {}, f'get_{table}_names')
+    return dict(zip(pd.to_numeric(names['id']).astype('int64'), names['name']))
+
+def query_breakdown(engine, start_date, end_date, dimension):
+    # 服务只有服务请求和事件才有，变更只计入组织统计
+    change_branch = """
+            UNION ALL
+            
+            SELECT 
+                t.org_id AS dim_id,
+                c2.status,
+                0 AS tto_75_passed,
+                0 AS ttr_75_passed
+            FROM ticket t 
+            JOIN `change` c2 ON c2.id = t.id
+            WHERE c2.status <> 'new'
+                AND t.start_date >= %(start_date)s
+                AND t.start_date < %(end_date)s
+    """ if dimension == 'organization' else ""
+    request_dim, incident_dim = ('t.org_id', 't.org_id') if dimension == 'organization' else ('tr.service_id', 'ti.service_id')
+    query = f"""
+    SELECT 
+        COALESCE(u.dim_id, 0) AS dim_id,
+        COUNT(*) AS total,
+        SUM(CASE WHEN u.status NOT IN ('closed', 'new', 'resolved') THEN 1 ELSE 0 END) AS unresolved,
+        SUM(CASE WHEN (u.tto_75_passed = 1 OR u.ttr_75_passed = 1) THEN 1 ELSE 0 END) AS overdue
+    FROM (
+        SELECT 
+            {request_dim} AS dim_id,
+            tr.status,
+            tr.tto_75_passed,
+            tr.ttr_75_passed
+        FROM ticket t 
+        JOIN ticket_request tr ON tr.id = t.id 
+        WHERE tr.status <> 'new'
+            AND t.start_date >= %(start_date)s
+            AND t.start_date < %(end_date)s
+        
+        UNION ALL
+        
+        SELECT 
+            {incident_dim} AS dim_id,
+            ti.status,
+            ti.tto_75_passed,
+            ti.ttr_75_passed
+        FROM ticket t 
+        JOIN ticket_incident ti ON ti.id = t.id
+        WHERE ti.status <> 'new'
+            AND t.start_date >= %(start_date)s
+            AND t.start_date < %(end_date)s
+        {change_branch}
+    ) AS u
+    GROUP BY COALESCE(u.dim_id, 0)
+    """
+    grouped = execute_query(engine, query, {'start_date': start_date, 'end_date': end_date}, f'get_{dimension}_breakdown')
+    stats = fold_breakdown_top(grouped, get_breakdown_top())
+    return format_breakdown(stats, get_dimension_names(engine, dimension), '组织' if dimension == 'organization' else '服务')
+
+# 按工单数量(相同时按编号)取前N个分组，其余合并为一行，编号记为-1
+def fold_breakdown_top(grouped, top):
+    grouped = grouped[['dim_id', 'total', 'unresolved', 'overdue']].apply(pd.to_numeric).fillna(0).astype('int64')
+    grouped = grouped.sort_values(['total', 'dim_id'], ascending=[False, True])
+    stats = grouped.iloc[:top].rename(columns={'dim_id': 'bucket_id'})
+    rest = grouped.iloc[top:]
+    if not rest.empty:
+        other = pd.DataFrame([{'bucket_id': -1, 'total': rest['total'].sum(), 'unresolved': rest['unresolved'].sum(), 'overdue': rest['overdue'].sum()}])
+        stats = pd.concat([stats, other])
+    return stats.reset_index(drop=True)
+
+# 由工单明细计算组织或服务统计(按团队拆分的报表使用)，口径与数据库中的查询一致
+def breakdown_from_facts(facts, dimension):
+    id_col, name_col, label = ('org_id', 'org_name', '组织') if dimension == 'organization' else ('service_id', 'service_name', '服务')
+    if dimension == 'service':
+        facts = facts[facts['ticket_type'] != '变更']
+    df = facts.assign(
+        dim_id=facts[id_col],
+        unresolved=~facts['status'].isin(['closed', 'new', 'resolved']),
+        overdue=(facts['tto_75_passed'] == 1) | (facts['ttr_75_passed'] == 1),
+    )
+    grouped = df.groupby('dim_id').agg(total=('dim_id', 'size'), unresolved=('unresolved', 'sum'), overdue=('overdue', 'sum')).reset_index()
+    names = {dim_id: name for dim_id, name in zip(df['dim_id'], df[name_col]) if pd.notna(name)}
+    return format_breakdown(fold_breakdown_top(grouped, get_breakdown_top()), names, label)
+
+# 按名称表补充名称，并计算与团队统计口径一致的解决率和及时率
+def format_breakdown(stats, names, label):
+    ids = pd.to_numeric(stats['bucket_id']).astype('int64')
+    total = pd.to_numeric(stats['total']).astype('int64')
+    unresolved = pd.to_numeric(stats['unresolved']).astype('int64')
+    overdue = pd.to_numeric(stats['overdue']).astype('int64')
+    return pd.DataFrame({
+        label: [('其他' if i == -1 else names.get(i, '未指定')) for i in ids],
+        '工单数量': total,
+        '未解决': unresolved,
+        '超时工单': overdue,
+        '工单解决率': ((total - unresolved) * 100 / total).map('{:.2f}%'.format),
+        '工单及时率': ((total - overdue) * 100 / total).map('{:.2f}%'.format),
+    })
+
+def get_org_breakdown(engine, start_date, end_date):
+    return query_breakdown(engine, start_date, end_date, 'organization')
+
+def get_service_breakdown(engine, start_date, end_date):
+    return query_breakdown(engine, start_date, end_date, 'service')
+
+# 报表数据集，顺序与generate_pdf的参数一致
+REPORT_QUERIES = [
+    ('ticket_summary', get_ticket_summary),
+    ('user_request_stats', get_user_request_stats),
+    ('incident_stats', get_incident_stats),
+    ('change_stats', get_change_stats),
+    ('team_stats', get_team_stats),
+    ('person_stats', get_person_stats),
+    ('unresolved_tickets', get_unresolved_tickets),
+    ('overdue_tickets', get_overdue_tickets),
+    ('backlog_curve', get_backlog_curve),
+    ('duration_histogram', get_duration_histogram),
+    ('org_breakdown', get_org_breakdown),
+    ('service_breakdown', get_service_breakdown),
+]
+
+REPORT_TABLES = [name for name, _ in REPORT_QUERIES]
+
+# 页面打开时即加载的汇总数据，其余章节在展开或导出PDF时才查询
+SUMMARY_TABLES = ['ticket_summary', 'user_request_stats', 'incident_stats', 'change_stats']
+
+# 获取指定周期的报表数据(默认全部)
+def fetch_report_data(engine, start_date, end_date, names=None):
+    names = REPORT_TABLES if names is None else names
+    business_hours = load_work_calendar() is not None
+    # 开启工作日历时处理时长分布完全由工单明细计算，不再执行数据库端的分桶查询
+    data = {name: query(engine, start_date, end_date) for name, query in REPORT_QUERIES
+            if name in names and not (business_hours and name == 'duration_histogram')}
+    # 开启工作日历时，团队和人员统计的处理时长改为按工单明细计算的工作时长
+    if business_hours and any(name in names for name in ['team_stats', 'person_stats', 'duration_histogram']):
+        facts = get_ticket_facts(engine, start_date, end_date)
+        if 'team_stats' in data:
+            data['team_stats'] = apply_business_hours(data['team_stats'], facts, '团队', 'team_name')
+        if 'person_stats' in data:
+            data['person_stats'] = apply_business_hours(data['person_stats'], facts, '办理人', 'agent_name')
+        if 'duration_histogram' in names:
+            data['duration_histogram'] = histogram_from_facts(facts)
+    return data
+
+# 数据快照文件格式：
+# 文件头(魔数 + 版本号) + 每张表一段Arrow IPC数据 + JSON目录 + 目录长度 + 魔数
+SNAPSHOT_MAGIC = b'ITOPSNAP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = '.snap'
+
+def get_snapshot_dir():
+    return load_config().get('Snapshot', 'dir', fallback='snapshots')
+
+def snapshot_file_name(start_date, end_date):
+    return f"itop_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}{SNAPSHOT_SUFFIX}"
+
+# 预热数据的快照文件，与页面上手动保存的快照分开命名，手动保存不会覆盖预热结果
+def prewarm_snapshot_path(start_date, end_date):
+    return os.path.join(get_snapshot_dir(), 'prewarm_' + snapshot_file_name(start_date, end_date))
+
+# DataFrame转换为Arrow表，混合类型的列(如数值与'N/A'混排)转为字符串
+def dataframe_to_arrow(df):
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+# 将报表数据保存为快照文件
+def save_snapshot(path, start_date, end_date, data, meta=None):
+    # 使用lz4压缩：读取时转换为DataFrame总会把各列复制到进程内存，不压缩也省不掉这次复制，
+    # 内存映射的作用只是按目录跳过不需要的表；压缩使快照文件更小，解压的开销很小
+    options = pa.ipc.IpcWriteOptions(compression='lz4')
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tables = {}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(SNAPSHOT_VERSION.to_bytes(4, 'little'))
+        for name, df in data.items():
+            sink = pa.BufferOutputStream()
+            table = dataframe_to_arrow(df)
+            with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+            buf = sink.getvalue()
+            tables[name] = {'offset': f.tell(), 'length': buf.size}
+            f.write(buf)
+
+        footer = json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'tables': tables,
+            'meta': meta or {},
+        }, ensure_ascii=False).encode('utf-8')
+        f.write(footer)
+        f.write(len(footer).to_bytes(8, 'little'))
+        f.write(SNAPSHOT_MAGIC)
+    # 先写临时文件再替换，避免读取到写了一半的快照
+    os.replace(tmp_path, path)
+    return path
+
+# 读取快照目录信息
+def read_snapshot_info(source):
+    source.seek(0)
+    if source.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        raise ValueError("不是有效的iTop报表快照文件")
+    version = int.from_bytes(source.read(4), 'little')
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(f"不支持的快照版本: {version}")
+
+    size = source.size()
+    source.seek(size - len(SNAPSHOT_MAGIC) - 8)
+    footer_length = int.from_bytes(source.read(8), 'little')
+    if source.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        raise ValueError("快照文件不完整")
+    source.seek(size - len(SNAPSHOT_MAGIC) - 8 - footer_length)
+    return json.loads(source.read(footer_length).decode('utf-8'))
+
+# 从快照文件加载报表数据(内存映射读取，只解析需要的表)
+def load_snapshot(path, names=None):
+    with pa.memory_map(path, 'r') as source:
+        info = read_snapshot_info(source)
+        data = {}
+        for name, entry in info['tables'].items():
+            if names is not None and name not in names:
+                continue
+            source.seek(entry['offset'])
+            buf = source.read_buffer(entry['length'])
+            data[name] = pa.ipc.open_file(buf).read_all().to_pandas()
+    start_date = datetime.strptime(info['start_date'], '%Y-%m-%d').date()
+    end_date = datetime.strptime(info['end_date'], '%Y-%m-%d').date()
+    return start_date, end_date, data, info
+
+# 列出快照目录中的快照文件
+def list_snapshots(directory=None):
+    directory = directory or get_snapshot_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SNAPSHOT_SUFFIX)),
+        reverse=True
+    )
 
-def generate_pdf(start_date, end_date, ticket_summary, user_request_stats, incident_stats, change_stats, team_stats, person_stats, unresolved_tickets, overdue_tickets):
+# 预热数据的有效期(无法校验水位线时使用)：包含今天的周期按刷新间隔判断，已结束的周期按max_age判断
+def prewarm_max_age(end_date):
+    config = load_config()
+    if end_date >= date.today():
+        return 2 * config.getint('Prewarm', 'refresh_interval', fallback=1800)
+    return config.getint('Prewarm', 'max_age', fallback=7 * 24 * 3600)
+
+# 预热数据是否仍然有效：快照中记录了水位线且可以连接数据库时，以水位线是否变化为准，
+# 未变化的周期一直有效，有工单被修改时立即失效；否则按有效期判断。
+# 指定names时只校验这些表，每张表按其查询范围的水位线校验
+def is_prewarm_fresh(engine, start_date, end_date, names=None):
+    path = prewarm_snapshot_path(start_date, end_date)
+    if not os.path.exists(path):
+        return False
+    try:
+        with pa.memory_map(path, 'r') as source:
+            meta = read_snapshot_info(source).get('meta', {})
+    except (OSError, ValueError) as e:
+        print(f"Ignoring snapshot {path}: {e}")
+        return False
+    # 只使用预热生成的快照(其他方式保存的快照没有水位线，无法校验)
+    if not meta.get('prewarmed'):
+        return False
+    if engine is not None:
+        watermarks = meta.get('watermarks')
+        if watermarks is not None:
+            ranges = {tuple(entry) for name, entry in watermarks.items() if names is None or name in names}
+            probe = get_watermark_probe()
+            return all(watermark == probe.get(engine, range_start, range_end) for range_start, range_end, watermark in ranges)
+    return time.time() - os.path.getmtime(path) <= prewarm_max_age(end_date)
+
+# 读取预热好的报表数据，没有或已过期时返回None
+def load_prewarmed(engine, start_date, end_date, names):
+    path = prewarm_snapshot_path(start_date, end_date)
+    if not is_prewarm_fresh(engine, start_date, end_date, names):
+        return None
+    try:
+        _, _, data, _ = load_snapshot(path, names)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        print(f"Ignoring snapshot {path}: {e}")
+        return None
+    if any(name not in data for name in names):
+        return None
+    return data
+
+# 读取预热好的PDF报表，没有、已过期或比快照旧(只刷新了数据)时返回None
+def load_prewarmed_pdf(engine, start_date, end_date):
+    path = prewarm_snapshot_path(start_date, end_date)
+    pdf_path = path[:-len(SNAPSHOT_SUFFIX)] + '.pdf'
+    if not os.path.exists(pdf_path) or os.path.getmtime(pdf_path) < os.path.getmtime(path) or not is_prewarm_fresh(engine, start_date, end_date, REPORT_TABLES):
+        return None
+    with open(pdf_path, 'rb') as f:
+        return f.read()
+
+# 直接从快照文件生成PDF，无需连接数据库
+def generate_pdf_from_snapshot(path):
+    start_date, end_date, data, _ = load_snapshot(path, REPORT_TABLES)
+    return generate_pdf(start_date, end_date, **data)
+
+@record_pdf_metrics
+def generate_pdf(start_date, end_date, ticket_summary, user_request_stats, incident_stats, change_stats, team_stats, person_stats, unresolved_tickets, overdue_tickets, backlog_curve=None, duration_histogram=None, org_breakdown=None, service_breakdown=None, team=None):
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter)
     elements = []
@@ -394,11 +1808,12 @@ def generate_pdf(start_date, end_date, ticket_summary, user_request_stats, incid
     subtitle_style.fontName = 'SimKai'
     normal_style.fontName = 'SimKai'
 
-    # 添加标题
+    # 添加标题(按团队拆分的报表在标题中注明团队)
+    report_name = f"iTop 运维服务报表 - {xml_escape(team)}" if team else "iTop 运维服务报表"
     if start_date.month == end_date.month:
-        title = f"<para alignment='center'>iTop 运维服务报表 ({start_date.year}年{start_date.month}月)</para>"
+        title = f"<para alignment='center'>{report_name} ({start_date.year}年{start_date.month}月)</para>"
     else:
-        title = f"<para alignment='center'>iTop 运维服务报表 ({start_date.year}年{start_date.month}月至{end_date.year}年{end_date.month}月)</para>"
+        title = f"<para alignment='center'>{report_name} ({start_date.year}年{start_date.month}月至{end_date.year}年{end_date.month}月)</para>"
     elements.append(Paragraph(title, title_style))
     elements.append(Spacer(1, 12))
 
@@ -827,13 +2242,383 @@ def generate_pdf(start_date, end_date, ticket_summary, user_request_stats, incid
         elements.append(overdue_table)
     else:
         elements.append(Paragraph("本周期内没有SLA超时的工单。", normal_style))
-        
+
+    # 7. 未解决工单每日趋势(旧快照中没有该数据时不输出)
+    if backlog_curve is not None:
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph("6. 未解决工单每日趋势", subtitle_style))
+        total_curve = backlog_curve[backlog_curve['维度'] == '全部']
+        if not total_curve.empty and total_curve['未解决工单'].max() > 0:
+            team_curves = backlog_curve[backlog_curve['维度'] == '团队'].pivot(index='日期', columns='名称', values='未解决工单')
+            elements.append(Paragraph(f"本周期内每日未解决工单平均 {total_curve['未解决工单'].mean():.1f} 个，最多 {total_curve['未解决工单'].max()} 个。", normal_style))
+            elements.append(Spacer(1, 12))
+
+            drawing = Drawing(500, 280)
+            lp = LinePlot()
+            lp.x = 40
+            lp.y = 50
+            lp.height = 180
+            lp.width = 420
+            days = list(range(len(total_curve)))
+            lp.data = [list(zip(days, total_curve['未解决工单']))] + [list(zip(days, team_curves[team])) for team in team_curves.columns]
+            # 全部工单画为面积图，各团队画为折线
+            palette = [HexColor('#00b8a9'), HexColor('#f6416c'), HexColor('#ffde7d'), HexColor('#5c7aea'), HexColor('#8d6e63'), HexColor('#9c27b0')]
+            line_colors = [HexColor('#a6e3df')] + [palette[i % len(palette)] for i in range(len(team_curves.columns))]
+            for i, color in enumerate(line_colors):
+                lp.lines[i].strokeColor = color
+                lp.lines[i].strokeWidth = 1
+            lp.lines[0].inFill = True
+            lp.xValueAxis.valueMin = 0
+            lp.xValueAxis.valueMax = max(days[-1], 1)
+            # 横轴最多显示10个日期刻度
+            step = max(1, len(days) // 10)
+            lp.xValueAxis.valueSteps = days[::step]
+            labels = [d.strftime('%m-%d') for d in total_curve['日期']]
+            lp.xValueAxis.labelTextFormat = lambda x: labels[int(x)] if 0 <= int(x) < len(labels) else ''
+            lp.xValueAxis.labels.fontName = 'SimKai'
+            lp.xValueAxis.labels.fontSize = 8
+            lp.yValueAxis.valueMin = 0
+            lp.yValueAxis.visibleGrid = True
+            lp.yValueAxis.gridStrokeColor = colors.Color(0.9, 0.9, 0.9)
+            lp.yValueAxis.gridStrokeWidth = 0.5
+            drawing.add(lp)
+
+            legend = Legend()
+            legend.x = lp.x
+            legend.y = lp.y + lp.height + 35
+            legend.fontName = 'SimKai'
+            legend.fontSize = 9
+            legend.alignment = 'right'
+            legend.columnMaximum = 2
+            legend.deltax = 75
+            legend.colorNamePairs = list(zip(line_colors, ['全部'] + list(team_curves.columns)))
+            drawing.add(legend)
+            elements.append(drawing)
+
+            # 工程师在手工单最多的前10名
+            workload = summarize_agent_workload(backlog_curve, 10)
+            if not workload.empty:
+                elements.append(Paragraph("工程师在手工单(前10名)", normal_style))
+                elements.append(Spacer(1, 6))
+                workload_data = [workload.columns.tolist()] + workload.values.tolist()
+                table_width = letter[0] * 0.85
+                workload_table = Table(workload_data, colWidths=[table_width / len(workload_data[0])] * len(workload_data[0]))
+                workload_table.setStyle(TableStyle([
+                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                    ('FONTNAME', (0, 0), (-1, -1), 'SimKai'),
+                    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                    ('FONTSIZE', (0, 0), (-1, -1), 10),
+                    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ]))
+                elements.append(workload_table)
+        else:
+            elements.append(Paragraph("本周期内没有未解决的工单。", normal_style))
+
+    # 8. 处理时长分布(旧快照中没有该数据时不输出)
+    if duration_histogram is not None:
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph("7. 处理时长分布", subtitle_style))
+        if not duration_histogram.empty:
+            # 区间名称取自数据本身，快照生成后修改分桶配置也能正确显示
+            bucket_names = duration_histogram.drop_duplicates('区间序号').set_index('区间序号')['区间']
+            labels = [bucket_names.get(i, '') for i in range(bucket_names.index.max() + 1)]
+            ticket_types = [t for t in ['服务请求', '事件', '变更'] if t in set(duration_histogram['工单类型'])]
+            bar_colors = [HexColor('#00b8a9'), HexColor('#f6416c'), HexColor('#ffde7d')]
+            for metric in ['响应时长', '解决时长']:
+                counts = duration_histogram[duration_histogram['指标'] == metric].pivot_table(
+                    index='工单类型', columns='区间序号', values='工单数', aggfunc='sum', fill_value=0
+                ).reindex(index=ticket_types, columns=range(len(labels)), fill_value=0)
+                counts = counts[counts.sum(axis=1) > 0]
+                if counts.empty:
+                    continue
+                drawing = Drawing(500, 260)
+                chart = VerticalBarChart()
+                chart.x = 40
+                chart.y = 60
+                chart.height = 150
+                chart.width = 440
+                chart.data = [list(row) for row in counts.values]
+                chart.categoryAxis.categoryNames = labels
+                chart.categoryAxis.labels.fontName = 'SimKai'
+                chart.categoryAxis.labels.fontSize = 7
+                chart.categoryAxis.labels.angle = 30
+                chart.categoryAxis.labels.boxAnchor = 'ne'
+                chart.valueAxis.valueMin = 0
+                chart.valueAxis.visibleGrid = True
+                chart.valueAxis.gridStrokeColor = colors.Color(0.9, 0.9, 0.9)
+                for i, ticket_type in enumerate(counts.index):
+                    chart.bars[i].fillColor = bar_colors[ticket_types.index(ticket_type)]
+                drawing.add(chart)
+
+                legend = Legend()
+                legend.x = chart.x
+                legend.y = chart.y + chart.height + 30
+                legend.fontName = 'SimKai'
+                legend.fontSize = 9
+                legend.alignment = 'right'
+                legend.columnMaximum = 1
+                legend.deltax = 75
+                legend.colorNamePairs = [(bar_colors[ticket_types.index(t)], t) for t in counts.index]
+                drawing.add(legend)
+
+                elements.append(Paragraph(f"{metric}分布", normal_style))
+                elements.append(drawing)
+        else:
+            elements.append(Paragraph("本周期内没有要处理的工单", normal_style))
+
+    # 9. 按客户组织和服务统计(旧快照中没有该数据时不输出)
+    for number, title, breakdown in [(8, "按客户组织统计", org_breakdown), (9, "按服务统计", service_breakdown)]:
+        if breakdown is None:
+            continue
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph(f"{number}. {title}(工单最多的前{get_breakdown_top()}个，其余合并为“其他”)", subtitle_style))
+        if breakdown.empty:
+            elements.append(Paragraph("本周期内没有要处理的工单", normal_style))
+            continue
+        breakdown_data = [breakdown.columns.tolist()] + breakdown.values.tolist()
+        table_width = letter[0] * 0.85
+        breakdown_table = Table(breakdown_data, colWidths=[table_width / len(breakdown_data[0])] * len(breakdown_data[0]))
+        breakdown_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, -1), 'SimKai'),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]))
+        for i, row in enumerate(breakdown_data):
+            for j, cell in enumerate(row):
+                breakdown_table._cellvalues[i][j] = Paragraph(str(cell), normal_style)
+        elements.append(breakdown_table)
+
     doc.build(elements)
     pdf = buffer.getvalue()
     buffer.close()
     return pdf
 
+# 由工单明细计算工单统计(与get_ticket_summary的结果格式一致)
+def ticket_summary_from_facts(facts):
+    return pd.DataFrame([{
+        'total': len(facts),
+        'request_total': int((facts['ticket_type'] == '服务请求').sum()),
+        'change_total': int((facts['ticket_type'] == '变更').sum()),
+        'Incident_total': int((facts['ticket_type'] == '事件').sum()),
+    }])
+
+# 由工单明细计算某类工单的状态统计(与get_user_request_stats等的结果格式一致)
+def status_stats_from_facts(facts, ticket_type):
+    status = facts.loc[facts['ticket_type'] == ticket_type, 'status']
+    resolved = status.isin(['closed', 'resolved'])
+    return pd.DataFrame([{
+        'total': len(status),
+        'resolved_total': int(resolved.sum()),
+        'closed_total': int((status == 'closed').sum()),
+        'unresolved_total': int((~resolved).sum()),
+    }])
+
+# 由工单明细计算按人员统计(与get_person_stats的结果格式一致)
+def person_stats_from_facts(facts):
+    df = facts[facts['agent_id'] != 0].assign(
+        month=pd.to_datetime(facts['start_date']).dt.strftime('%Y-%m'),
+        unresolved=~facts['status'].isin(['closed', 'new', 'resolved']),
+        overdue=(facts['tto_75_passed'] == 1) | (facts['ttr_75_passed'] == 1),
+    )
+    grouped = df.groupby(['month', 'agent_name', 'ticket_type'])
+    count = grouped.size()
+    stats = pd.DataFrame({
+        '工单数量': count,
+        '未解决': grouped['unresolved'].sum(),
+        '超时工单': grouped['overdue'].sum(),
+        '工单解决率': ((count - grouped['unresolved'].sum()) * 100 / count).map('{:.2f}%'.format),
+        '工单及时率': ((count - grouped['overdue'].sum()) * 100 / count).map('{:.2f}%'.format),
+        '平均响应时长(分钟)': (grouped['response_time'].mean() / 60).round(2).astype(object),
+        '平均解决时长(分钟)': (grouped['resolution_time'].mean() / 60).round(2),
+        '最大响应时长(分钟)': (grouped['response_time'].max() / 60).round(2).astype(object),
+        '最大解决时长(分钟)': (grouped['resolution_time'].max() / 60).round(2),
+    })
+    stats.index.names = ['月份', '办理人', '工单类型']
+    stats = stats.reset_index()
+    is_change = stats['工单类型'] == '变更'
+    stats.loc[is_change, ['平均响应时长(分钟)', '最大响应时长(分钟)']] = 'N/A'
+    return stats.sort_values(['月份', '工单类型', '办理人'], ascending=[False, False, True]).reset_index(drop=True)
+
+# 拆分出某个团队的报表数据：汇总类数据由该团队的工单明细重新计算，明细类数据按团队过滤
+def partition_report_data(data, facts, team):
+    team_facts = facts[facts['team_name'] == team]
+    tables = {
+        'ticket_summary': ticket_summary_from_facts(team_facts),
+        'user_request_stats': status_stats_from_facts(team_facts, '服务请求'),
+        'incident_stats': status_stats_from_facts(team_facts, '事件'),
+        'change_stats': status_stats_from_facts(team_facts, '变更'),
+        'team_stats': data['team_stats'][data['team_stats']['团队'] == team].reset_index(drop=True),
+        'person_stats': person_stats_from_facts(team_facts),
+        'unresolved_tickets': data['unresolved_tickets'][data['unresolved_tickets']['团队名称'] == team].reset_index(drop=True),
+        'overdue_tickets': data['overdue_tickets'][data['overdue_tickets']['团队名称'] == team].reset_index(drop=True),
+    }
+    # 团队报表的未解决工单趋势只保留该团队的曲线
+    if 'backlog_curve' in data:
+        curve = data['backlog_curve']
+        tables['backlog_curve'] = curve[(curve['维度'] == '团队') & (curve['名称'] == team)].assign(维度='全部').reset_index(drop=True)
+    if 'duration_histogram' in data:
+        histogram = data['duration_histogram']
+        tables['duration_histogram'] = histogram[histogram['团队'] == team].reset_index(drop=True)
+    # 组织和服务统计按该团队的工单明细重新计算(旧快照的明细中没有组织和服务时省略)
+    if 'org_breakdown' in data and 'org_id' in facts.columns:
+        tables['org_breakdown'] = breakdown_from_facts(team_facts, 'organization')
+    if 'service_breakdown' in data and 'service_id' in facts.columns:
+        tables['service_breakdown'] = breakdown_from_facts(team_facts, 'service')
+    return tables
+
+# 拆分报表的工作进程在初始化时通过内存映射读取一次共享数据，之后每个任务只传递团队名称
+_burst_state = {}
+
+def init_burst_worker(snapshot_path):
+    start_date, end_date, data, _ = load_snapshot(snapshot_path)
+    _burst_state.update(start_date=start_date, end_date=end_date, data=data)
+
+def render_burst_pdf(team):
+    data = _burst_state['data']
+    if team is None:
+        tables = {name: data[name] for name in REPORT_TABLES if name in data}
+    else:
+        tables = partition_report_data(data, data['ticket_facts'], team)
+    return team, generate_pdf(_burst_state['start_date'], _burst_state['end_date'], team=team, **tables)
+
+def burst_file_name(team):
+    if team is None:
+        return 'itop_report_全公司.pdf'
+    return 'itop_report_' + ''.join('_' if c in '\\/:*?"<>|' else c for c in team) + '.pdf'
+
+# 按团队拆分PDF：全公司报表加每个团队一份，在多个工作进程中并行生成，返回 {文件名: PDF内容}
+def burst_reports(start_date, end_date, data, facts, workers=None):
+    teams = sorted(set(facts['team_name']) - {'未分配'})
+    workers = workers or load_config().getint('Burst', 'workers', fallback=os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory() as directory:
+        path = save_snapshot(os.path.join(directory, 'burst' + SNAPSHOT_SUFFIX), start_date, end_date,
+                             {**{name: data[name] for name in REPORT_TABLES if name in data}, 'ticket_facts': facts})
+        # 使用spawn启动工作进程，避免fork复制Streamlit服务进程中的线程和连接；
+        # 页面中本脚本以__main__运行，工作进程需按模块名导入才能找到任务函数
+        module = importlib.import_module(os.path.splitext(os.path.basename(__file__))[0]) if __name__ == '__main__' else sys.modules[__name__]
+        with ProcessPoolExecutor(max_workers=min(workers, len(teams) + 1), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=module.init_burst_worker, initargs=(path,)) as pool:
+            return {burst_file_name(team): pdf for team, pdf in pool.map(module.render_burst_pdf, [None] + teams)}
+
+# 拆分报表所需的工单明细：离线模式取自快照，否则优先使用预热数据
+def load_burst_facts(engine, snapshot_path, start_date, end_date):
+    if snapshot_path:
+        _, _, snapshot_data, _ = load_snapshot(snapshot_path, ['ticket_facts'])
+        return snapshot_data.get('ticket_facts')
+    prewarmed = load_prewarmed(engine, start_date, end_date, ['ticket_facts'])
+    if prewarmed is not None:
+        return prewarmed['ticket_facts']
+    return get_ticket_facts(engine, start_date, end_date)
+
+def write_burst_zip(pdfs):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, pdf in pdfs.items():
+            archive.writestr(name, pdf)
+    return buffer.getvalue()
+
+def write_burst_dir(pdfs, directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, pdf in pdfs.items():
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(pdf)
+
+# 性能分析目标：环境变量ITOP_REPORT_PROFILE或[Profile] target，
+# main表示分析一次完整的页面重跑，pdf表示分析一次generate_pdf调用，未设置时不分析
+def get_profile_target():
+    target = os.environ.get('ITOP_REPORT_PROFILE') or load_config().get('Profile', 'target', fallback='')
+    target = target.strip().lower()
+    if target in ('', '0', 'false', 'off'):
+        return None
+    return 'pdf' if target == 'pdf' else 'main'
+
+# 按所属模块对函数自身耗时分类，用于判断时间花在SQL、pandas、Plotly还是reportlab上
+PROFILE_CATEGORIES = [
+    (('sqlalchemy', 'pymysql'), 'SQL'),
+    (('pandas', 'numpy', 'pyarrow'), 'pandas'),
+    (('plotly',), 'Plotly'),
+    (('reportlab',), 'reportlab'),
+    (('streamlit',), 'Streamlit'),
+]
+
+def profile_category(filename, function):
+    # 查询在后台线程执行，脚本线程等待查询结果的时间记为等待查询
+    if filename == '~' and 'acquire' in function:
+        return '等待查询'
+    parts = filename.replace('\\', '/').split('/')
+    for modules, category in PROFILE_CATEGORIES:
+        if any(module in parts for module in modules):
+            return category
+    return '其他'
+
+# 汇总性能分析结果：自身耗时最多的函数，以及按分类汇总的耗时
+def summarize_profile(profiler, top):
+    rows = []
+    for (filename, line, function), (_, calls, self_time, total_time, _) in pstats.Stats(profiler).stats.items():
+        rows.append({
+            '函数': f"{function} ({os.path.basename(filename)}:{line})",
+            '分类': profile_category(filename, function),
+            '调用次数': calls,
+            '自身耗时(秒)': self_time,
+            '累计耗时(秒)': total_time,
+        })
+    functions = pd.DataFrame(rows)
+    categories = functions.groupby('分类')['自身耗时(秒)'].sum().sort_values(ascending=False).round(3)
+    hot = functions.sort_values('自身耗时(秒)', ascending=False).head(top).round(3).reset_index(drop=True)
+    return hot, categories
+
+# 保存分析文件并汇总热点函数
+def save_profile(profiler, label, started):
+    elapsed = time.time() - started
+    config = load_config()
+    directory = config.get('Profile', 'dir', fallback='profiles')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+    profiler.dump_stats(path)
+    print(f"Profile of {label} saved to {path} ({elapsed:.2f}s)")
+    hot, categories = summarize_profile(profiler, config.getint('Profile', 'top', fallback=20))
+    return path, elapsed, hot, categories
+
+# 在性能分析下执行一次调用(目标与配置不符时直接调用，不产生额外开销)，保存分析文件并在侧边栏展示热点函数
+def run_profiled(target, label, func, *args, **kwargs):
+    if get_profile_target() != target:
+        return func(*args, **kwargs)
+
+    profiler = cProfile.Profile()
+    started = time.time()
+    profiler.enable()
+    try:
+        result = func(*args, **kwargs)
+    except (StopException, RerunException):
+        # st.stop()或页面重跑中断了本次运行：仍保存分析文件并在日志中输出汇总，页面内容已不会再显示
+        profiler.disable()
+        categories = save_profile(profiler, label, started)[3]
+        print(f"Profile of {label} interrupted by stop or rerun, time by category:\n{categories.to_string()}")
+        raise
+    finally:
+        profiler.disable()
+
+    path, elapsed, hot, categories = save_profile(profiler, label, started)
+    with st.sidebar.expander(f"性能分析：{label} 耗时 {elapsed:.2f} 秒", expanded=True):
+        st.dataframe(categories, use_container_width=True)
+        st.dataframe(hot, use_container_width=True)
+        with open(path, 'rb') as f:
+            st.download_button("下载分析文件", f.read(), file_name=os.path.basename(path), mime="application/octet-stream")
+    return result
+
 def main():
+    # 启动监控指标输出和HTTP接口(未配置时不启动)
+    start_metrics_exporter()
+    start_api_server()
+
     # 创建左边栏
     with st.sidebar:
         st.title("iTop 报表查询")
@@ -841,37 +2626,64 @@ def main():
         # 添加一条横线
         st.markdown("---")
 
-        # 添加日期选择提示
-        st.markdown("""
-        <div>  </div>
-        <div style='color: #808080; font-style: italic;'>
-        请选择要查询的开始日期和结束日期\r\n
-        (系统默认为上一个月的数据)
-        </div>
-        """, unsafe_allow_html=True)
-
-        # 日期选择
-        today = datetime.now()
-        last_month = today.replace(day=1) - timedelta(days=1)
-        
-        st.markdown("开始日期", unsafe_allow_html=True)
-        start_date = st.date_input("", last_month.replace(day=1), key="start_date", label_visibility="collapsed")
-        
-        st.markdown("结束日期", unsafe_allow_html=True)
-        end_date = st.date_input("", last_month.replace(day=calendar.monthrange(last_month.year, last_month.month)[1]), key="end_date", label_visibility="collapsed")
-
-        # 连接数据库
-        engine = connect_to_itop_db()
-
-        # 获取数据
-        ticket_summary = get_ticket_summary(engine, start_date, end_date)
-        user_request_stats = get_user_request_stats(engine, start_date, end_date)
-        incident_stats = get_incident_stats(engine, start_date, end_date)
-        change_stats = get_change_stats(engine, start_date, end_date)
-        team_stats = get_team_stats(engine, start_date, end_date)
-        person_stats = get_person_stats(engine, start_date, end_date)
-        unresolved_tickets = get_unresolved_tickets(engine, start_date, end_date)
-        overdue_tickets = get_overdue_tickets(engine, start_date, end_date)
+        # 选择数据来源：iTop数据库或离线快照(设置环境变量ITOP_REPORT_SNAPSHOT时固定使用该快照)
+        snapshot_path = os.environ.get('ITOP_REPORT_SNAPSHOT')
+        if not snapshot_path:
+            source = st.radio("数据来源", ["iTop数据库", "离线快照"], horizontal=True)
+            if source == "离线快照":
+                snapshots = list_snapshots()
+                if not snapshots:
+                    st.warning(f"快照目录 {get_snapshot_dir()} 中没有可用的快照文件")
+                    st.stop()
+                snapshot_path = st.selectbox("快照文件", snapshots, format_func=os.path.basename)
+
+        if snapshot_path:
+            # 离线模式：全部数据来自快照文件，不连接数据库
+            engine = None
+            start_date, end_date, _, snapshot_info = load_snapshot(snapshot_path, [])
+            st.markdown(f"""
+            <div style='color: #808080; font-style: italic;'>
+            离线快照：{os.path.basename(snapshot_path)}\r\n
+            (生成于 {snapshot_info['created_at']})
+            </div>
+            """, unsafe_allow_html=True)
+        else:
+            # 添加日期选择提示
+            st.markdown("""
+            <div>  </div>
+            <div style='color: #808080; font-style: italic;'>
+            请选择要查询的开始日期和结束日期\r\n
+            (系统默认为上一个月的数据)
+            </div>
+            """, unsafe_allow_html=True)
+
+            # 日期选择
+            today = datetime.now()
+            last_month = today.replace(day=1) - timedelta(days=1)
+            
+            st.markdown("开始日期", unsafe_allow_html=True)
+            start_date = st.date_input("", last_month.replace(day=1), key="start_date", label_visibility="collapsed")
+            
+            st.markdown("结束日期", unsafe_allow_html=True)
+            end_date = st.date_input("", last_month.replace(day=calendar.monthrange(last_month.year, last_month.month)[1]), key="end_date", label_visibility="collapsed")
+
+            # 连接数据库
+            engine = connect_to_itop_db()
+
+        # 先只获取汇总数据，其余章节按需加载
+        def load_tables(names):
+            return load_report_tables(engine, snapshot_path, start_date, end_date, names)
+
+        try:
+            data = load_tables(SUMMARY_TABLES)
+        except QueryTimeoutError as e:
+            st.error(f"{e}，请缩小查询的日期范围后重试。")
+            st.stop()
+
+        ticket_summary = data['ticket_summary']
+        user_request_stats = data['user_request_stats']
+        incident_stats = data['incident_stats']
+        change_stats = data['change_stats']
 
         # 插入一行空行
         st.write("")
@@ -881,7 +2693,9 @@ def main():
         with col3:
             if st.button('导出PDF报表'):
                 try:
-                    pdf = generate_pdf(start_date, end_date, ticket_summary, user_request_stats, incident_stats, change_stats, team_stats, person_stats, unresolved_tickets, overdue_tickets)
+                    pdf = None if snapshot_path or get_profile_target() == 'pdf' else load_prewarmed_pdf(engine, start_date, end_date)
+                    if pdf is None:
+                        pdf = run_profiled('pdf', 'generate_pdf', generate_pdf, start_date, end_date, **load_tables(REPORT_TABLES))
                     with col3:
                         st.download_button(
                             label="下载PDF报表",
@@ -893,6 +2707,53 @@ def main():
                     st.error(f"生成PDF时发生错误: {str(e)}")
                     st.error("请检查是否安装了所需的中文字体。")
 
+        # 按团队拆分导出PDF(全公司一份，每个团队一份)，打包为zip下载
+        col1, col2, col3 = st.columns([1, 1, 2])
+        with col3:
+            if st.button('按团队导出PDF'):
+                try:
+                    facts = load_burst_facts(engine, snapshot_path, start_date, end_date)
+                    if facts is None:
+                        st.warning("该快照中没有工单明细数据，无法按团队拆分。")
+                    else:
+                        with st.spinner("正在生成各团队的PDF报表..."):
+                            pdfs = burst_reports(start_date, end_date, load_tables(REPORT_TABLES), facts)
+                        st.download_button(
+                            label=f"下载PDF报表({len(pdfs)}份)",
+                            data=write_burst_zip(pdfs),
+                            file_name=f"itop_report_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.zip",
+                            mime="application/zip"
+                        )
+                except QueryTimeoutError as e:
+                    st.error(f"{e}，请缩小查询的日期范围后重试。")
+                except Exception as e:
+                    st.error(f"生成PDF时发生错误: {str(e)}")
+
+        # 保存数据快照，供离线查看或重新生成报表
+        if not snapshot_path:
+            col1, col2, col3 = st.columns([1, 1, 2])
+            with col3:
+                if st.button('保存数据快照'):
+                    try:
+                        # 连同工单明细一起保存，离线时可以逐级钻取和按团队导出PDF
+                        snapshot_data = dict(load_tables(REPORT_TABLES), ticket_facts=load_period_facts(engine, None, start_date, end_date))
+                        path = save_snapshot(os.path.join(get_snapshot_dir(), snapshot_file_name(start_date, end_date)), start_date, end_date, snapshot_data)
+                        with open(path, 'rb') as f:
+                            st.download_button(
+                                label="下载数据快照",
+                                data=f.read(),
+                                file_name=os.path.basename(path),
+                                mime="application/octet-stream"
+                            )
+                    except Exception as e:
+                        st.error(f"保存数据快照时发生错误: {str(e)}")
+
+        # 环比对比(需要连接数据库)
+        show_comparison = engine is not None and st.checkbox("显示环比对比")
+
+        # 团队/工程师/工单逐级钻取
+        show_drill_down = st.checkbox("显示逐级钻取")
+
     # 主要内容区域
     st.markdown("<h2 style='text-align: center;'>iTop 运维服务报表</h2>", unsafe_allow_html=True)
 
@@ -1010,70 +2871,532 @@ def main():
     else:
         st.write("无法获取变更统计数据。")
 
-    # 3. 按照工单处理团队统计
-    st.write("#### 2. 按照工单处理团队统计，具体如下")
-    st.dataframe(team_stats, use_container_width=True)
+    # 3. 按照工单处理团队统计(以下章节展开时才查询，结果保存在会话中)
+    team_stats = load_section(load_tables, "#### 2. 按照工单处理团队统计，具体如下", 'team_stats')
+    if team_stats is not None:
+        if load_work_calendar() is not None:
+            st.markdown("<div style='color: #808080; font-style: italic;'>处理时长按工作日历计算，不含非工作时段和节假日</div>", unsafe_allow_html=True)
+        st.dataframe(team_stats, use_container_width=True)
 
-    # 3.1 按照工单处理团队绘制服务请求的解决率
-    # 将team_stats转换为pandas DataFrame
-    df = pd.DataFrame(team_stats)
+        # 3.1 按照工单处理团队绘制服务请求的解决率
+        # 将team_stats转换为pandas DataFrame
+        df = pd.DataFrame(team_stats)
     
-    # 按月份和团队分组计算平均解决率和及时率
-    df['工单解决率'] = df['工单解决率'].apply(lambda x: float(str(x).rstrip('%')))
+        # 按月份和团队分组计算平均解决率和及时率
+        df['工单解决率'] = df['工单解决率'].apply(lambda x: float(str(x).rstrip('%')))
     
-    # 检查是否跨月
-    if len(df['月份'].unique()) > 1:
-        # 仅保留服务请求数据
-        service_request_df = df[df['工单类型'] == '服务请求']
-        # 创建解决率曲线图
-        fig1 = px.line(service_request_df, 
-                      x='月份', 
-                      y='工单解决率',
-                      color='团队',
-                      markers=True,
-                      text='工单解决率',  # 添加数值标签
-                      title='各团队服务请求月度解决率趋势')
+        # 检查是否跨月
+        if len(df['月份'].unique()) > 1:
+            # 仅保留服务请求数据
+            service_request_df = df[df['工单类型'] == '服务请求']
+            # 创建解决率曲线图
+            fig1 = px.line(service_request_df, 
+                          x='月份', 
+                          y='工单解决率',
+                          color='团队',
+                          markers=True,
+                          text='工单解决率',  # 添加数值标签
+                          title='各团队服务请求月度解决率趋势')
         
-        # 配置数值标签的显示
-        fig1.update_traces(
-            textposition="top center",  # 将数值显示在点的上方居中
-            texttemplate='%{text:.1f}%'  # 显示格式:保留1位小数并加上%号
-        )
+            # 配置数值标签的显示
+            fig1.update_traces(
+                textposition="top center",  # 将数值显示在点的上方居中
+                texttemplate='%{text:.1f}%'  # 显示格式:保留1位小数并加上%号
+            )
         
-        fig1.update_layout(
-            title_x=0.35,
-            title_y=0.95, # 将标题向上移动
-            xaxis_title='月份',
-            yaxis_title='解决率(%)',
-            yaxis=dict(range=[0, 110]),
-            xaxis=dict(
-                type='category',
-                categoryorder='category ascending'
-            ),
-            margin=dict(t=100), # 增加顶部边距
-            legend=dict(
-                orientation="h",  # 水平方向
-                yanchor="bottom",
-                y=1.05,  # 调整图例位置,与标题保持10px间距
-                xanchor="center",
-                x=0.5,  # 图例水平居中
-                itemwidth=30,  # 设置图例项的宽度,使团队名称显示在一行
-                title=None  # 取消图例标题
+            fig1.update_layout(
+                title_x=0.35,
+                title_y=0.95, # 将标题向上移动
+                xaxis_title='月份',
+                yaxis_title='解决率(%)',
+                yaxis=dict(range=[0, 110]),
+                xaxis=dict(
+                    type='category',
+                    categoryorder='category ascending'
+                ),
+                margin=dict(t=100), # 增加顶部边距
+                legend=dict(
+                    orientation="h",  # 水平方向
+                    yanchor="bottom",
+                    y=1.05,  # 调整图例位置,与标题保持10px间距
+                    xanchor="center",
+                    x=0.5,  # 图例水平居中
+                    itemwidth=30,  # 设置图例项的宽度,使团队名称显示在一行
+                    title=None  # 取消图例标题
+                )
             )
-        )
-        st.plotly_chart(fig1)
+            st.plotly_chart(fig1)
 
     # 4. 按照工程师统计
-    st.write("#### 3. 按照工单处理工程师统计，具体如下")
-    st.dataframe(person_stats, use_container_width=True)
+    person_stats = load_section(load_tables, "#### 3. 按照工单处理工程师统计，具体如下", 'person_stats')
+    if person_stats is not None:
+        st.dataframe(person_stats, use_container_width=True)
 
     # 5. 未解决的工单
-    st.write("#### 4. 未解决的工单如下")
-    st.dataframe(unresolved_tickets, use_container_width=True)
+    unresolved_tickets = load_section(load_tables, "#### 4. 未解决的工单如下", 'unresolved_tickets')
+    if unresolved_tickets is not None:
+        st.dataframe(unresolved_tickets, use_container_width=True)
 
     # 6. 超时的工单
-    st.write("#### 5. SLA超时的工单如下")
-    st.dataframe(overdue_tickets, use_container_width=True)
+    overdue_tickets = load_section(load_tables, "#### 5. SLA超时的工单如下", 'overdue_tickets')
+    if overdue_tickets is not None:
+        st.dataframe(overdue_tickets, use_container_width=True)
+
+    # 7. 未解决工单每日趋势
+    backlog_curve = load_section(load_tables, "#### 6. 未解决工单每日趋势", 'backlog_curve')
+    if backlog_curve is not None:
+        show_backlog_section(backlog_curve)
+
+    # 8. 处理时长分布
+    duration_histogram = load_section(load_tables, "#### 7. 处理时长分布", 'duration_histogram')
+    if duration_histogram is not None:
+        show_histogram_section(duration_histogram)
+
+    # 9. 按客户组织和服务统计
+    org_breakdown = load_section(load_tables, "#### 8. 按客户组织统计", 'org_breakdown')
+    if org_breakdown is not None:
+        show_breakdown_section(org_breakdown, '组织')
+    service_breakdown = load_section(load_tables, "#### 9. 按服务统计", 'service_breakdown')
+    if service_breakdown is not None:
+        show_breakdown_section(service_breakdown, '服务')
+
+    # 10. 环比对比
+    if show_comparison:
+        show_month_comparison(engine, snapshot_path, start_date, end_date)
+
+    # 11. 逐级钻取
+    if show_drill_down:
+        show_drill_down_section(engine, snapshot_path, start_date, end_date)
+
+# 按需加载的报表数据：同一会话、同一周期内每张表只查询一次；切换周期、数据来源或周期水位线变化时清空
+def load_report_tables(engine, snapshot_path, start_date, end_date, names):
+    watermark = get_watermark_probe().get(engine, start_date, end_date) if engine is not None else None
+    period = (snapshot_path or '', str(start_date), str(end_date), watermark)
+    if st.session_state.get('report_period') != period:
+        st.session_state['report_period'] = period
+        st.session_state['report_tables'] = {}
+    tables = st.session_state['report_tables']
+    missing = [name for name in names if name not in tables]
+    if missing:
+        if snapshot_path:
+            _, _, loaded, _ = load_snapshot(snapshot_path, missing)
+        else:
+            # 已预热的周期直接读取预热结果
+            loaded = load_prewarmed(engine, start_date, end_date, missing) or fetch_report_data(engine, start_date, end_date, missing)
+        for name in missing:
+            # 旧快照中没有的表记为None，不再重复读取
+            tables[name] = loaded.get(name)
+    return {name: tables[name] for name in names if tables[name] is not None}
+
+# 可折叠的报表章节：勾选展开后才加载数据，未展开或数据不可用时返回None
+def load_section(load_tables, title, name):
+    st.write(title)
+    if not st.checkbox("展开", key=f"section_{name}"):
+        return None
+    try:
+        table = load_tables([name]).get(name)
+    except QueryTimeoutError as e:
+        st.error(f"{e}，请缩小查询的日期范围后重试。")
+        return None
+    if table is None:
+        st.write("该快照中没有这部分数据。")
+    return table
+
+# 未解决工单每日趋势：按团队堆叠的面积图，以及工程师在手工单统计
+def show_backlog_section(backlog_curve):
+    team_curves = backlog_curve[backlog_curve['维度'] == '团队']
+    if team_curves.empty or backlog_curve['未解决工单'].max() == 0:
+        st.write("本周期内没有未解决的工单。")
+        return
+    fig = px.area(team_curves, x='日期', y='未解决工单', color='名称', title='每日未解决工单数(按团队)')
+    fig.update_layout(
+        title_x=0.35,
+        xaxis_title='日期',
+        yaxis_title='未解决工单数',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title=None)
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.write("##### 工程师在手工单")
+    st.dataframe(summarize_agent_workload(backlog_curve), use_container_width=True)
+
+# 处理时长分布：可选择指标和团队，按工单类型分组的柱状图
+def show_histogram_section(duration_histogram):
+    if duration_histogram.empty:
+        st.write("本周期内没有要处理的工单")
+        return
+    col1, col2 = st.columns(2)
+    with col1:
+        metric = st.radio("指标", ['解决时长', '响应时长'], horizontal=True, key="histogram_metric")
+    with col2:
+        team = st.selectbox("团队", ['全部'] + sorted(duration_histogram['团队'].unique()), key="histogram_team")
+    selected = duration_histogram[duration_histogram['指标'] == metric]
+    if team != '全部':
+        selected = selected[selected['团队'] == team]
+    counts = selected.groupby(['工单类型', '区间序号', '区间'], as_index=False)['工单数'].sum().sort_values('区间序号')
+    fig = px.bar(counts, x='区间', y='工单数', color='工单类型', barmode='group',
+                 category_orders={'区间': duration_histogram.sort_values('区间序号')['区间'].unique().tolist()},
+                 title=f'{metric}分布')
+    fig.update_layout(
+        title_x=0.4,
+        xaxis_title=f'{metric}(对数区间)',
+        yaxis_title='工单数',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title=None)
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+# 按组织/服务统计：前N名和"其他"的工单数量柱状图及明细表
+def show_breakdown_section(breakdown, label):
+    if breakdown.empty:
+        st.write("本周期内没有要处理的工单")
+        return
+    st.markdown(f"<div style='color: #808080; font-style: italic;'>工单最多的前{get_breakdown_top()}个{label}，其余合并为“其他”</div>", unsafe_allow_html=True)
+    fig = px.bar(breakdown, x=label, y=['工单数量', '超时工单'], barmode='group', title=f'各{label}工单数量')
+    fig.update_layout(
+        title_x=0.4,
+        xaxis_title=label,
+        yaxis_title='工单数',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title=None)
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(breakdown, use_container_width=True)
+
+# 环比对比：各月汇总数据来自查询缓存，切换对比月份时只需查询未缓存的月份
+def show_month_comparison(engine, snapshot_path, start_date, end_date):
+    st.write("#### 10. 环比对比")
+    months = [start_date.replace(day=1)]
+    for _ in range(23):
+        months.append((months[-1] - timedelta(days=1)).replace(day=1))
+
+    col1, col2 = st.columns(2)
+    with col1:
+        current_month = st.selectbox("本期", months, index=0, format_func=lambda m: m.strftime('%Y-%m'))
+    with col2:
+        previous_month = st.selectbox("对比期", months, index=1, format_func=lambda m: m.strftime('%Y-%m'))
+
+    try:
+        # 本期就是页面的周期时直接使用页面的工单明细，只有对比期需要查询
+        if month_period(current_month) == (start_date, end_date):
+            current = aggregate_month_facts(load_period_facts(engine, snapshot_path, start_date, end_date))
+        else:
+            current = get_month_aggregates(engine, current_month)
+        previous = get_month_aggregates(engine, previous_month)
+    except QueryTimeoutError as e:
+        st.error(str(e))
+        return
+
+    st.markdown(f"<div style='color: #808080; font-style: italic;'>{current_month.strftime('%Y-%m')} 对比 {previous_month.strftime('%Y-%m')}，标红为较上期变差的指标</div>", unsafe_allow_html=True)
+    for key, title in [('type', '##### 1) 工单总体'), ('team', '##### 2) 按团队'), ('agent', '##### 3) 按工程师')]:
+        st.write(title)
+        compared, regressions = compare_aggregates(current[key], previous[key])
+        st.dataframe(highlight_regressions(compared, regressions), use_container_width=True)
+
+# 预热指定周期：查询报表数据和工单明细并保存为快照，可同时生成PDF
+def prewarm_period(engine, start_date, end_date, with_pdf=True):
+    started = time.time()
+    # 先取水位线再查询，查询期间有工单变化时水位线会不一致，下次使用时重新查询；
+    # 水位线按每张表的查询范围记录：未解决工单趋势包含周期开始前max_open_days天内创建的工单，
+    # 并统计到结束日期的次日，其余各表按 start_date ~ end_date 查询
+    watermark = [str(start_date), str(end_date), get_period_watermark(engine, start_date, end_date)]
+    backlog_start, backlog_end = backlog_open_since(start_date), end_date + timedelta(days=1)
+    backlog_watermark = [str(backlog_start), str(backlog_end), get_period_watermark(engine, backlog_start, backlog_end)]
+    data = fetch_report_data(engine, start_date, end_date)
+    if start_date.replace(day=1) == end_date.replace(day=1):
+        # 工单明细与页面使用同一周期，页面、钻取和环比对比可以直接复用
+        data['ticket_facts'] = get_ticket_facts(engine, start_date, end_date)
+    watermarks = {name: backlog_watermark if name == 'backlog_curve' else watermark for name in data}
+    path = prewarm_snapshot_path(start_date, end_date)
+    # 周期结束后连同PDF一起生成的快照标记为最终版本，调度器据此判断上个月是否已完成预热
+    final = with_pdf and end_date < date.today()
+    save_snapshot(path, start_date, end_date, data, meta={'prewarmed': True, 'watermarks': watermarks, 'final': final})
+
+    if with_pdf:
+        pdf = generate_pdf(start_date, end_date, **{name: data[name] for name in REPORT_TABLES})
+        pdf_path = path[:-len(SNAPSHOT_SUFFIX)] + '.pdf'
+        with open(pdf_path + '.tmp', 'wb') as f:
+            f.write(pdf)
+        os.replace(pdf_path + '.tmp', pdf_path)
+    print(f"Prewarmed {start_date} ~ {end_date} in {time.time() - started:.1f}s: {path}")
+    return path
+
+# 快照是否为周期结束后生成的最终版本(本月刷新写入的是同一个快照文件，不能只看文件是否存在)
+def is_final_prewarm(path):
+    if not os.path.exists(path):
+        return False
+    try:
+        with pa.memory_map(path, 'r') as source:
+            return bool(read_snapshot_info(source).get('meta', {}).get('final'))
+    except (OSError, ValueError) as e:
+        print(f"Ignoring snapshot {path}: {e}")
+        return False
+
+# 常驻运行：每月1日到达配置时间后预热上个月，并按刷新间隔刷新本月数据
+def run_scheduler(engine):
+    config = load_config()
+    run_at = config.get('Prewarm', 'time', fallback='06:00')
+    refresh_interval = config.getint('Prewarm', 'refresh_interval', fallback=1800)
+    next_refresh = 0
+
+    while True:
+        now = datetime.now()
+        last_month_start, last_month_end = month_period((now.replace(day=1) - timedelta(days=1)).date())
+        last_month_path = prewarm_snapshot_path(last_month_start, last_month_end)
+        try:
+            if now.strftime('%H:%M') >= run_at and not is_final_prewarm(last_month_path):
+                prewarm_period(engine, last_month_start, last_month_end)
+            if time.time() >= next_refresh:
+                # 本月数据的水位线未变化时不必重新查询
+                current_start, current_end = month_period(now.date())
+                if not is_prewarm_fresh(engine, current_start, current_end):
+                    prewarm_period(engine, current_start, current_end, with_pdf=False)
+                next_refresh = time.time() + refresh_interval
+        except Exception as e:
+            print(f"Prewarm failed: {e}")
+        time.sleep(30)
+
+# 只读HTTP接口：以JSON或CSV提供报表汇总数据，与页面共用连接池、查询缓存和预热数据
+# 接口对应的报表数据表，通过fetch_report_data获取，与页面一样按工作日历计算处理时长
+API_ENDPOINTS = {
+    '/api/summary': 'ticket_summary',
+    '/api/user_requests': 'user_request_stats',
+    '/api/incidents': 'incident_stats',
+    '/api/changes': 'change_stats',
+    '/api/teams': 'team_stats',
+    '/api/persons': 'person_stats',
+    '/api/organizations': 'org_breakdown',
+    '/api/services': 'service_breakdown',
+}
+
+# 过滤参数与列名的对应关系，也可以直接使用中文列名过滤
+API_FILTERS = {'month': '月份', 'team': '团队', 'agent': '办理人', 'type': '工单类型'}
+
+# 各接口返回的列名(列由查询语句固定，第一次查询后记录)，用于在查询之前拒绝不支持的过滤条件
+_api_columns = {}
+
+# 返回第一个不支持的过滤条件，接口的列名尚未记录时不做判断
+def unsupported_api_filter(name, params):
+    columns = _api_columns.get(name)
+    if columns is None:
+        return None
+    return next((key for key in params if API_FILTERS.get(key, key) not in columns), None)
+
+class ApiHandler(BaseHTTPRequestHandler):
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json_error(self, status, message):
+        self.send_body(status, json.dumps({'error': message}, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in API_ENDPOINTS:
+            self.send_json_error(404, f"未知的接口，可用接口: {', '.join(API_ENDPOINTS)}")
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        # 默认为上个月
+        try:
+            default_start, default_end = month_period(date.today().replace(day=1) - timedelta(days=1))
+            start_date = datetime.strptime(params.pop('start'), '%Y-%m-%d').date() if 'start' in params else default_start
+            end_date = datetime.strptime(params.pop('end'), '%Y-%m-%d').date() if 'end' in params else default_end
+        except ValueError:
+            self.send_json_error(400, "start和end的格式应为YYYY-MM-DD")
+            return
+        output_format = params.pop('format', 'json')
+        if output_format not in ('json', 'csv'):
+            self.send_json_error(400, "format只支持json或csv")
+            return
+
+        name = API_ENDPOINTS[url.path]
+        unsupported = unsupported_api_filter(name, params)
+        if unsupported:
+            self.send_json_error(400, f"不支持的过滤条件: {unsupported}")
+            return
+        try:
+            engine = connect_to_itop_db()
+            data = load_prewarmed(engine, start_date, end_date, [name]) or fetch_report_data(engine, start_date, end_date, [name])
+            df = data[name]
+            _api_columns[name] = set(df.columns)
+        except QueryTimeoutError as e:
+            self.send_json_error(504, str(e))
+            return
+        except Exception as e:
+            print(f"API query failed: {e}")
+            self.send_json_error(500, "查询失败")
+            return
+
+        unsupported = unsupported_api_filter(name, params)
+        if unsupported:
+            self.send_json_error(400, f"不支持的过滤条件: {unsupported}")
+            return
+        for key, value in params.items():
+            df = df[df[API_FILTERS.get(key, key)].astype(str) == value]
+
+        if output_format == 'csv':
+            body = df.to_csv(index=False).encode('utf-8-sig')
+            content_type = 'text/csv; charset=utf-8'
+        else:
+            body = df.to_json(orient='records', force_ascii=False, date_format='iso').encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+
+        # 内容不变时ETag不变，轮询的客户端带上If-None-Match即可得到304
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.end_headers()
+            return
+        self.send_body(200, body, content_type, headers)
+
+    def log_message(self, format, *args):
+        pass
+
+def create_api_server(port=None):
+    config = load_config()
+    address = (config.get('API', 'host', fallback='127.0.0.1'), port or config.getint('API', 'port', fallback=8502))
+    return ThreadingHTTPServer(address, ApiHandler)
+
+# 随页面一起启动HTTP接口(配置了[API] port时)，每个进程只启动一次
+@st.cache_resource
+def start_api_server():
+    if not load_config().getint('API', 'port', fallback=0):
+        return None
+    # 端口已被占用(例如运行了多个Streamlit进程)时只记录错误，页面不受影响；
+    # cache_resource不缓存异常，这里不捕获的话每次重跑都会再次报错
+    try:
+        server = create_api_server()
+    except OSError as e:
+        print(f"Failed to start report API: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name='itop-api', daemon=True).start()
+    print(f"Serving report API on {server.server_address[0]}:{server.server_address[1]}")
+    return server
+
+CLI_COMMANDS = ('prewarm', 'schedule', 'api', 'burst', 'pdf')
+
+# 命令行入口，供cron或系统服务调用
+def cli(argv):
+    parser = argparse.ArgumentParser(prog='itop_report.py', description='iTop 运维服务报表命令行工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    prewarm_parser = subparsers.add_parser('prewarm', help='预热上个月(或指定月份)的报表数据和PDF')
+    prewarm_parser.add_argument('--month', help='要预热的月份，格式为YYYY-MM，默认为上个月')
+    prewarm_parser.add_argument('--current', action='store_true', help='同时刷新本月的报表数据')
+    subparsers.add_parser('schedule', help='常驻运行，按配置的时间自动预热')
+    api_parser = subparsers.add_parser('api', help='单独运行只读HTTP接口')
+    api_parser.add_argument('--port', type=int, help='监听端口，默认使用[API] port')
+    burst_parser = subparsers.add_parser('burst', help='按团队拆分生成上个月(或指定月份)的PDF报表')
+    burst_parser.add_argument('--month', help='报表月份，格式为YYYY-MM，默认为上个月')
+    burst_parser.add_argument('--output', default='reports', help='输出目录，默认为reports')
+    burst_parser.add_argument('--zip', action='store_true', help='输出为zip文件而不是目录')
+    burst_parser.add_argument('--workers', type=int, help='并行进程数，默认使用[Burst] workers')
+    pdf_parser = subparsers.add_parser('pdf', help='由快照文件生成PDF报表，无需连接数据库')
+    pdf_parser.add_argument('--snapshot', required=True, help='快照文件路径')
+    pdf_parser.add_argument('--output', help='输出的PDF文件，默认与快照同名')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pdf':
+        path = args.output or os.path.splitext(args.snapshot)[0] + '.pdf'
+        with open(path, 'wb') as f:
+            f.write(generate_pdf_from_snapshot(args.snapshot))
+        print(f"Generated PDF report: {path}")
+        return
+
+    if args.command == 'api':
+        server = create_api_server(args.port)
+        print(f"Serving report API on {server.server_address[0]}:{server.server_address[1]}")
+        server.serve_forever()
+        return
+
+    engine = connect_to_itop_db()
+    if args.command == 'schedule':
+        run_scheduler(engine)
+        return
+
+    if args.month:
+        month_start = datetime.strptime(args.month, '%Y-%m').date()
+    else:
+        month_start = date.today().replace(day=1) - timedelta(days=1)
+
+    if args.command == 'burst':
+        start_date, end_date = month_period(month_start)
+        data = load_prewarmed(engine, start_date, end_date, REPORT_TABLES) or fetch_report_data(engine, start_date, end_date)
+        pdfs = burst_reports(start_date, end_date, data, load_burst_facts(engine, None, start_date, end_date), args.workers)
+        if args.zip:
+            path = args.output if args.output.endswith('.zip') else args.output + '.zip'
+            with open(path, 'wb') as f:
+                f.write(write_burst_zip(pdfs))
+        else:
+            path = args.output
+            write_burst_dir(pdfs, path)
+        print(f"Generated {len(pdfs)} PDF reports: {path}")
+        return
+
+    prewarm_period(engine, *month_period(month_start))
+    if args.current:
+        prewarm_period(engine, *month_period(date.today()), with_pdf=False)
+
+# 本周期的工单明细：离线模式取自快照，其次使用预热数据，否则查询数据库；
+# 同一会话、同一周期只获取一次，环比对比和逐级钻取共用；切换周期、数据来源或周期水位线变化时重新获取
+def load_period_facts(engine, snapshot_path, start_date, end_date):
+    watermark = get_watermark_probe().get(engine, start_date, end_date) if engine is not None else None
+    period = (snapshot_path or '', str(start_date), str(end_date), watermark)
+    cached = st.session_state.get('period_facts')
+    if cached is not None and cached[0] == period:
+        return cached[1]
+    if snapshot_path:
+        _, _, snapshot_data, _ = load_snapshot(snapshot_path, ['ticket_facts'])
+        facts = snapshot_data.get('ticket_facts')
+    else:
+        prewarmed = load_prewarmed(engine, start_date, end_date, ['ticket_facts'])
+        facts = prewarmed['ticket_facts'] if prewarmed is not None else get_ticket_facts(engine, start_date, end_date)
+    st.session_state['period_facts'] = (period, facts)
+    return facts
+
+# 逐级钻取：团队 -> 工程师 -> 工单，本周期工单明细只获取一次，按团队和办理人索引后保存在会话中
+def show_drill_down_section(engine, snapshot_path, start_date, end_date):
+    st.write("#### 11. 团队、工程师和工单逐级查看")
+    # 会话中只保留当前周期的索引，切换周期、数据来源或周期水位线变化时替换
+    watermark = get_watermark_probe().get(engine, start_date, end_date) if engine is not None else None
+    period = (snapshot_path or '', str(start_date), str(end_date), watermark)
+    cached = st.session_state.get('drill_facts')
+    if cached is None or cached[0] != period:
+        facts = load_period_facts(engine, snapshot_path, start_date, end_date)
+        cached = (period, None if facts is None else index_ticket_facts(facts))
+        st.session_state['drill_facts'] = cached
+    indexed = cached[1]
+    if indexed is None:
+        st.write("该快照中没有工单明细数据。")
+        return
+    if indexed.empty:
+        st.write("本周期内没有要处理的工单")
+        return
+
+    teams = compute_period_aggregates(indexed.reset_index(), ['team_id', 'team_name'])
+    st.write("##### 1) 团队")
+    st.dataframe(teams.reset_index(level='team_id', drop=True), use_container_width=True)
+    team_names = dict(teams.index.tolist())
+    team_id = st.selectbox("选择团队", list(team_names), format_func=team_names.get)
+
+    team_facts = indexed.loc[[team_id]].reset_index()
+    agents = compute_period_aggregates(team_facts, ['agent_id', 'agent_name'])
+    st.write(f"##### 2) {team_names[team_id]} 的工程师")
+    st.dataframe(agents.reset_index(level='agent_id', drop=True), use_container_width=True)
+    agent_names = dict(agents.index.tolist())
+    agent_id = st.selectbox("选择工程师", list(agent_names), format_func=agent_names.get)
+
+    st.write(f"##### 3) {agent_names[agent_id]} 的工单")
+    st.dataframe(format_drill_tickets(indexed.loc[[(team_id, agent_id)]]), use_container_width=True)
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS and not st.runtime.exists():
+        cli(sys.argv[1:])
+    else:
+        run_profiled('main', 'main', main)
@@ -0,0 +1,293 @@
+import argparse
+import contextlib
+import io
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, event, text
+from streamlit import logger as streamlit_logger
+
+import itop_report
+
+# 模拟多人同时打开报表(例如每月1日上午)，压测 main() 的数据路径：
+# 全部 get_* 查询以及可选的 generate_pdf，统计吞吐量、延迟分位数、数据库连接占用和错误
+
+# 压测用的精简iTop表结构，只包含报表查询用到的字段
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS organization (
+        id INT PRIMARY KEY, name VARCHAR(255))""",
+    """CREATE TABLE IF NOT EXISTS contact (
+        id INT PRIMARY KEY, name VARCHAR(255), finalclass VARCHAR(255))""",
+    """CREATE TABLE IF NOT EXISTS person (
+        id INT PRIMARY KEY, first_name VARCHAR(255))""",
+    """CREATE TABLE IF NOT EXISTS service (
+        id INT PRIMARY KEY, name VARCHAR(255))""",
+    """CREATE TABLE IF NOT EXISTS ticket (
+        id INT PRIMARY KEY, ref VARCHAR(255), title VARCHAR(255), finalclass VARCHAR(255),
+        org_id INT, caller_id INT, team_id INT, agent_id INT,
+        start_date DATETIME, end_date DATETIME, close_date DATETIME, last_update DATETIME,
+        KEY start_date (start_date, last_update))""",
+    """CREATE TABLE IF NOT EXISTS ticket_request (
+        id INT PRIMARY KEY, status VARCHAR(255), service_id INT, approver_id INT,
+        assignment_date DATETIME, resolution_date DATETIME,
+        tto_started DATETIME, tto_stopped DATETIME, ttr_stopped DATETIME,
+        tto_75_passed TINYINT, ttr_75_passed TINYINT, tto_100_passed TINYINT, ttr_100_passed TINYINT,
+        tto_100_deadline DATETIME, ttr_100_deadline DATETIME, tto_100_overrun INT, ttr_100_overrun INT)""",
+    """CREATE TABLE IF NOT EXISTS ticket_incident (
+        id INT PRIMARY KEY, status VARCHAR(255), service_id INT,
+        assignment_date DATETIME, resolution_date DATETIME,
+        tto_started DATETIME, tto_stopped DATETIME, ttr_stopped DATETIME,
+        tto_75_passed TINYINT, ttr_75_passed TINYINT, tto_100_passed TINYINT, ttr_100_passed TINYINT,
+        tto_100_deadline DATETIME, ttr_100_deadline DATETIME, tto_100_overrun INT, ttr_100_overrun INT)""",
+    """CREATE TABLE IF NOT EXISTS `change` (
+        id INT PRIMARY KEY, status VARCHAR(255))""",
+]
+
+STATUSES = ['closed', 'resolved', 'assigned', 'pending', 'new']
+STATUS_WEIGHTS = [0.55, 0.2, 0.15, 0.05, 0.05]
+
+# 生成模拟数据：若干组织、团队、工程师，以及最近 months 个月内的 tickets 个工单
+def seed_database(engine, tickets, months, seed=0):
+    rng = random.Random(seed)
+    with engine.begin() as connection:
+        for statement in SCHEMA:
+            connection.execute(text(statement))
+        for table in ['organization', 'contact', 'person', 'service', 'ticket', 'ticket_request', 'ticket_incident', '`change`']:
+            connection.execute(text(f"DELETE FROM {table}"))
+
+        orgs = [{'id': i, 'name': f'客户{i}'} for i in range(1, 51)]
+        teams = [{'id': 1000 + i, 'name': f'运维{i}组', 'finalclass': 'Team'} for i in range(1, 9)]
+        people = [{'id': 2000 + i, 'name': f'工程师{i}', 'finalclass': 'Person'} for i in range(1, 81)]
+        services = [{'id': 3000 + i, 'name': f'服务{i}'} for i in range(1, 21)]
+        connection.execute(text("INSERT INTO organization (id, name) VALUES (:id, :name)"), orgs)
+        connection.execute(text("INSERT INTO contact (id, name, finalclass) VALUES (:id, :name, :finalclass)"), teams + people)
+        connection.execute(text("INSERT INTO person (id, first_name) VALUES (:id, '')"), [{'id': p['id']} for p in people])
+        connection.execute(text("INSERT INTO service (id, name) VALUES (:id, :name)"), services)
+
+        now = datetime.now()
+        earliest = now - timedelta(days=30 * months)
+        span = (now - earliest).total_seconds()
+        ticket_rows, request_rows, incident_rows, change_rows = [], [], [], []
+        for ticket_id in range(1, tickets + 1):
+            kind = rng.choices(['UserRequest', 'Incident', 'NormalChange'], [0.6, 0.3, 0.1])[0]
+            start = earliest + timedelta(seconds=rng.random() * span)
+            status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+            response = timedelta(minutes=rng.expovariate(1 / 30))
+            resolution = timedelta(hours=rng.expovariate(1 / 8))
+            tto_stopped = start + response
+            ttr_stopped = tto_stopped + resolution
+            closed = status in ('closed', 'resolved')
+            ticket_rows.append({
+                'id': ticket_id, 'ref': f'{kind[0]}-{ticket_id:06d}', 'title': f'压测工单{ticket_id}', 'finalclass': kind,
+                'org_id': rng.choice(orgs)['id'], 'caller_id': rng.choice(people)['id'],
+                'team_id': rng.choice(teams)['id'], 'agent_id': rng.choice(people)['id'],
+                'start_date': start, 'end_date': ttr_stopped if closed else None,
+                'close_date': ttr_stopped if status == 'closed' else None, 'last_update': ttr_stopped if closed else start,
+            })
+            if kind == 'NormalChange':
+                change_rows.append({'id': ticket_id, 'status': status})
+                continue
+            tto_passed = response > timedelta(minutes=45)
+            ttr_passed = resolution > timedelta(hours=12)
+            row = {
+                'id': ticket_id, 'status': status, 'service_id': rng.choice(services)['id'],
+                'assignment_date': tto_stopped, 'resolution_date': ttr_stopped if closed else None,
+                'tto_started': start, 'tto_stopped': tto_stopped, 'ttr_stopped': ttr_stopped if closed else None,
+                'tto_75_passed': int(tto_passed or response > timedelta(minutes=34)), 'ttr_75_passed': int(ttr_passed or resolution > timedelta(hours=9)),
+                'tto_100_passed': int(tto_passed), 'ttr_100_passed': int(ttr_passed),
+                'tto_100_deadline': start + timedelta(minutes=45), 'ttr_100_deadline': start + timedelta(hours=12),
+                'tto_100_overrun': max(0, int((response - timedelta(minutes=45)).total_seconds())),
+                'ttr_100_overrun': max(0, int((resolution - timedelta(hours=12)).total_seconds())),
+            }
+            (request_rows if kind == 'UserRequest' else incident_rows).append(row)
+
+        ticket_columns = list(ticket_rows[0]) if ticket_rows else []
+        sla_columns = list((request_rows or incident_rows)[0]) if (request_rows or incident_rows) else []
+        inserts = [
+            ('ticket', ticket_columns, ticket_rows),
+            ('ticket_request', sla_columns, request_rows),
+            ('ticket_incident', sla_columns, incident_rows),
+            ('`change`', ['id', 'status'], change_rows),
+        ]
+        for table, columns, rows in inserts:
+            if not rows:
+                continue
+            statement = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+            for i in range(0, len(rows), 5000):
+                connection.execute(statement, rows[i:i + 5000])
+    print(f"已生成 {tickets} 个模拟工单")
+
+# 解析日期范围分布，例如 "1:70,3:20,12:10" 表示70%查询1个月、20%查询3个月、10%查询12个月
+def parse_range_mix(value):
+    months, weights = [], []
+    for item in value.split(','):
+        span, weight = item.split(':')
+        months.append(int(span))
+        weights.append(float(weight))
+    return months, weights
+
+# 解析思考时间，例如 "1-5" 表示每次操作后随机等待1到5秒
+def parse_think_time(value):
+    low, _, high = value.partition('-')
+    return float(low), float(high or low)
+
+# 随机选择一个查询周期：跨度按分布抽取，结束月份为上个月往前随机偏移 spread 个月以内
+def pick_period(rng, months, weights, spread):
+    span = rng.choices(months, weights)[0]
+    end_month = date.today().replace(day=1) - timedelta(days=1)
+    for _ in range(rng.randrange(spread) if spread > 0 else 0):
+        end_month = end_month.replace(day=1) - timedelta(days=1)
+    start_month = end_month.replace(day=1)
+    for _ in range(span - 1):
+        start_month = (start_month - timedelta(days=1)).replace(day=1)
+    return start_month, itop_report.month_period(end_month)[1]
+
+# 连接池占用统计：新建连接数、借出次数、同时借出的连接数(峰值和采样均值)
+class PoolMonitor:
+    def __init__(self, engine):
+        self.connects = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak = 0
+        self.samples = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+
+    def _on_connect(self, *args):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, *args):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak = max(self.peak, self.checked_out)
+
+    def _on_checkin(self, *args):
+        with self._lock:
+            self.checked_out -= 1
+
+    def sample(self, interval=0.1):
+        while not self._stopped.wait(interval):
+            self.samples.append(self.checked_out)
+
+    def stop(self):
+        self._stopped.set()
+
+# 单个模拟会话：反复打开报表，直到到达结束时间
+def run_session(session_id, engine, args, deadline, stats):
+    rng = random.Random(args.seed + session_id)
+    months, weights = parse_range_mix(args.ranges)
+    think_low, think_high = parse_think_time(args.think_time)
+
+    while time.time() < deadline:
+        start_date, end_date = pick_period(rng, months, weights, args.month_spread)
+        page_started = time.time()
+        try:
+            data = {}
+            for name, query in itop_report.REPORT_QUERIES:
+                started = time.time()
+                data[name] = query(engine, start_date, end_date)
+                stats.record(name, time.time() - started)
+            if rng.random() < args.pdf_ratio:
+                started = time.time()
+                itop_report.generate_pdf(start_date, end_date, **data)
+                stats.record('generate_pdf', time.time() - started)
+            stats.record('page', time.time() - page_started)
+        except Exception as e:
+            stats.error(e)
+        time.sleep(rng.uniform(think_low, think_high))
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.latencies[name].append(seconds)
+
+    def error(self, e):
+        with self._lock:
+            self.errors[f"{type(e).__name__}: {str(e).splitlines()[0][:80] if str(e) else ''}"] += 1
+
+def format_latency_row(name, values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return f"{name:<24}{len(values):>8}{p50:>10.0f}{p95:>10.0f}{p99:>10.0f}{max(values) * 1000:>10.0f}"
+
+def print_report(args, elapsed, stats, monitor, engine):
+    pages = stats.latencies.get('page', [])
+    cache = itop_report.get_result_cache()
+    lookups = cache.hits + cache.misses
+    print()
+    print(f"会话数: {args.sessions}  持续时间: {elapsed:.1f}s  完成页面: {len(pages)}  吞吐量: {len(pages) / elapsed:.2f} 页面/秒")
+    print()
+    print(f"{'步骤':<22}{'次数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for name in ['page'] + [name for name, _ in itop_report.REPORT_QUERIES] + ['generate_pdf']:
+        if stats.latencies.get(name):
+            print(format_latency_row(name, stats.latencies[name]))
+    print()
+    print(f"数据库连接: 连接池大小 {engine.pool.size()}  新建连接 {monitor.connects}  借出次数 {monitor.checkouts}  "
+          f"同时借出峰值 {monitor.peak}  同时借出均值 {np.mean(monitor.samples) if monitor.samples else 0:.2f}")
+    print(f"查询缓存: 命中 {cache.hits} / {lookups}" + (f" ({cache.hits / lookups:.1%})" if lookups else ""))
+    print(f"错误: {sum(stats.errors.values())}")
+    for message, count in stats.errors.most_common():
+        print(f"  {count:>6}  {message}")
+
+def main():
+    parser = argparse.ArgumentParser(description='iTop 运维服务报表并发压测')
+    parser.add_argument('--db-url', default='mysql+pymysql://root@127.0.0.1:3306/itop_loadtest', help='压测使用的本地数据库(不要指向生产库)')
+    parser.add_argument('--seed-data', type=int, metavar='TICKETS', help='压测前重建表结构并生成指定数量的模拟工单')
+    parser.add_argument('--seed-months', type=int, default=24, help='模拟工单分布的月份数')
+    parser.add_argument('--sessions', type=int, default=20, help='同时在线的模拟会话数')
+    parser.add_argument('--duration', type=float, default=60, help='压测时长(秒)')
+    parser.add_argument('--ranges', default='1:70,3:20,12:10', help='日期范围分布，格式为 月数:权重,...')
+    parser.add_argument('--month-spread', type=int, default=1, help='结束月份在最近几个月内随机选择，1表示都查看上个月')
+    parser.add_argument('--think-time', default='1-5', help='每次打开报表后的思考时间(秒)，格式为 最小-最大')
+    parser.add_argument('--pdf-ratio', type=float, default=0.0, help='打开报表后导出PDF的比例(0~1)')
+    parser.add_argument('--pool-size', type=int, default=5, help='连接池大小')
+    parser.add_argument('--max-overflow', type=int, default=10, help='连接池允许的溢出连接数')
+    parser.add_argument('--no-cache', action='store_true', help='禁用查询结果缓存')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--verbose', action='store_true', help='输出每条查询的日志')
+    args = parser.parse_args()
+
+    streamlit_logger.set_log_level('error')
+    engine = create_engine(args.db_url, pool_size=args.pool_size, max_overflow=args.max_overflow, pool_pre_ping=True)
+    if args.seed_data:
+        seed_database(engine, args.seed_data, args.seed_months, args.seed)
+    if args.no_cache:
+        itop_report.get_result_cache().ttl = 0
+
+    monitor = PoolMonitor(engine)
+    stats = LoadStats()
+    sampler = threading.Thread(target=monitor.sample, daemon=True)
+    sampler.start()
+
+    started = time.time()
+    deadline = started + args.duration
+    sessions = [
+        threading.Thread(target=run_session, args=(i, engine, args, deadline, stats), daemon=True)
+        for i in range(args.sessions)
+    ]
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        for session in sessions:
+            session.start()
+        for session in sessions:
+            session.join()
+    elapsed = time.time() - started
+    monitor.stop()
+
+    print_report(args, elapsed, stats, monitor, engine)
+
+if __name__ == "__main__":
+    main()